@@ -1,34 +1,48 @@
 ''' Purpose of this Program is to retrieve updated information from an excel file.
     Then perform update action in the database based on the updated info.'''
 
+from __future__ import annotations
+
 import pyodbc_sql_function as sql
-import pandas as pd
-from excel_file_handler import Excel_Csv_Handler
-from typing import Union, List, Dict, Tuple, NoReturn
+from job_runner import stage
+import os
+from typing import Union, List, Dict, Tuple, NoReturn, TYPE_CHECKING
+
+# pandas is only imported when the job runs, see pyodbc_sql_function
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 def ConvertExcelToDF(excel_file_path: str, sheet_name: str) -> pd.DataFrame:
     '''Import data from excel to a pandas dataframe'''
+    import pandas as pd
+
     with pd.ExcelFile(excel_file_path) as excel:
         df = pd.read_excel(excel, sheet_name)
         print(df)
         return df
 
 
-def UpdateVideoByDF(con_dict: Dict[str, str], df: str, sql_statement: str) -> NoReturn:
-    '''Iterate every row in the DataFrame and execute update statement'''
+def UpdateVideoByDF(con_dict: Dict[str, str], df: pd.DataFrame, sql_statement: str) -> NoReturn:
+    '''
+    Execute the parameterized update statement for every row in the DataFrame.
+    The statement is prepared once and all rows are sent in batches within a single connection.
+    The advertisement number is bound twice: once for the new title and once for the check that skips
+    videos already updated by an earlier run.
+    '''
+    param_list = []
     for row in df.values:
         advertisment_num = row[2]
         video_id = row[7]
-        update_statement = sql_statement.format(adv_num=advertisment_num, vdo_id=video_id)
 
         print("advertisement no: ", advertisment_num)
         print("video_id", video_id)
         print("\n")
 
-        print("Update Statement:\n", update_statement)
+        param_list.append((str(advertisment_num), str(video_id), str(advertisment_num)))
 
-        sql.ExecNonQuerySQL(con_dict, update_statement, return_con=False)
+    print("Update Statement:\n", sql_statement)
+    sql.ExecManySQL(con_dict, sql_statement, param_list, return_con=False)
 
 
 def main():
@@ -42,19 +56,22 @@ def main():
     sql_statement = """
                     update dbo.video
                     set [video_description] = v.[video_description] + char(13) + char(13) + N'拍攝日期: ' + replace(CONVERT(VARCHAR(10), v.ShootDate, 111), '/', '-') + char(13) + N'廣告日期: ' + replace(CONVERT(VARCHAR(10), m.video_date, 111), '/', '-'),
-	                    [video_title] = [video_title] + ' (' + N'物業編號: ' + '{adv_num}' + ')'
+	                    [video_title] = [video_title] + ' (' + N'物業編號: ' + ? + ')'
                     from dbo.video v
                     join dbo.menu m on v.menu_ID = m.menu_ID
-                    where v.type = 0 and v.code <> '' and v.video_ID = '{vdo_id}'
+                    where v.type = 0 and v.code <> '' and v.video_ID = ?
+                        -- the update appends text, so a video already having its advertisement number is skipped
+                        and CHARINDEX(N'(' + N'物業編號: ' + ? + ')', v.[video_title]) = 0
     """
 
-    sql_statement = "select top 100 * from dbo.video"
-
-    file_path = './video.xlsx'
+    file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'video.xlsx')
     sheet_name = '工作表1'
 
 
-    df = ConvertExcelToDF(file_path, sheet_name)
-    UpdateVideoByDF(con_dict_dest, df, sql_statement)
+    with stage("read_excel"):
+        df = ConvertExcelToDF(file_path, sheet_name)
+    with stage("update"):
+        UpdateVideoByDF(con_dict_dest, df, sql_statement)
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+'''Precomputed counts and sums at every level of the hierarchy produced by GetBuildingHma.
+
+The hierarchy is: building --> estate --> hma --> district --> territory
+Measures (e.g. number of units, number of advertised units) are given per building and summed up
+to every level in a single bottom-up pass. Each level keeps its totals in a numpy array,
+so the total of any territory / district / hma / estate is an index lookup instead of a GROUP BY on dbo.HmaHierarchy.
+
+When units or buildings move, only the totals on the affected paths are updated.
+'''
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, NoReturn, Tuple, Union
+
+import pyodbc_sql_function as sql
+
+# columns of the GetBuildingHma result, from the top level to the bottom level
+LEVELS = ('Terr', 'District', 'HMACode', 'centaest', 'centabldg')
+
+# friendly names of the levels that could be used in queries
+LEVEL_ALIAS = {
+    'territory': 'Terr',
+    'district': 'District',
+    'hma': 'HMACode',
+    'estate': 'centaest',
+    'building': 'centabldg',
+}
+
+# measure available without being given: number of buildings under each node
+BUILDING_COUNT = 'buildings'
+
+
+def NormalizeCode(code) -> str:
+    '''Codes from CHAR columns are padded with spaces'''
+    return str(code).strip()
+
+
+def GetUnitCountByBuilding(con_dict: Dict[str, str]) -> pd.Series:
+    '''Return the number of units of each building as a Series indexed by centabldg'''
+    sql_string = "SELECT cu.centabldg, COUNT(*) AS units FROM dbo.cenunit cu GROUP BY cu.centabldg"
+    df = sql.GetDataFromSqlToDF(con_dict, sql_string, False)
+    return df.set_index('centabldg')['units']
+
+
+def CountByBuilding(df: pd.DataFrame, building_column: str='centabldg') -> pd.Series:
+    '''Return the number of rows of each building, e.g. the number of advertised units from a list of units'''
+    return df.groupby(df[building_column].map(NormalizeCode)).size()
+
+
+class HmaRollup:
+    '''
+    Totals of measures at every level of the hierarchy.
+
+    Usage:
+        rollup = HmaRollup(GetBuildingHma(con_dict), {'units': GetUnitCountByBuilding(con_dict)})
+        rollup.Get('district', '沙田', 'units')
+        rollup.GetLevel('hma', 'units')             # a Series of totals of all hma
+        rollup.AddToBuilding('B000000001', 'units', 3)
+        rollup.MoveNode('building', 'B000000001', 'E000000002')
+    '''
+    def __init__(self, hierarchy: pd.DataFrame, measures: Optional[Dict[str, pd.Series]]=None):
+        df = hierarchy[list(LEVELS)].drop_duplicates('centabldg')
+        df = df.apply(lambda col: col.map(NormalizeCode))
+
+        self.codes = {}     # level -> list of codes, position is the index of the node
+        self.index = {}     # level -> {code: index}
+        self.parent = {}    # level -> array of the index of parent of each node in the level above
+        self.values = {}    # level -> {measure: array of totals}
+
+        level_codes = {}
+        for level in LEVELS:
+            node_index, uniques = pd.factorize(df[level])
+            level_codes[level] = node_index
+            self.codes[level] = list(uniques)
+            self.index[level] = {code: i for i, code in enumerate(uniques)}
+            self.values[level] = {}
+
+        # each node has a single parent, guaranteed by GetBuildingHma
+        self.parent[LEVELS[0]] = np.full(len(self.codes[LEVELS[0]]), -1, dtype=np.int64)
+        for upper, lower in zip(LEVELS[:-1], LEVELS[1:]):
+            parent = np.empty(len(self.codes[lower]), dtype=np.int64)
+            parent[level_codes[lower]] = level_codes[upper]
+            self.parent[lower] = parent
+
+        self.AddMeasure(BUILDING_COUNT, pd.Series(1, index=self.codes['centabldg']))
+        for name, leaf_values in (measures or {}).items():
+            self.AddMeasure(name, leaf_values)
+
+    @staticmethod
+    def _Level(level: str) -> str:
+        level = LEVEL_ALIAS.get(level, level)
+        if level not in LEVELS:
+            raise KeyError("Unknown level: {}".format(level))
+        return level
+
+    def _Path(self, level: str, node: int) -> List[Tuple[str, int]]:
+        '''Return (level, index) of a node and all its ancestors'''
+        path = []
+        depth = LEVELS.index(level)
+        while depth >= 0 and node >= 0:
+            level = LEVELS[depth]
+            path.append((level, node))
+            node = self.parent[level][node]
+            depth -= 1
+        return path
+
+    def AddMeasure(self, name: str, leaf_values: pd.Series) -> NoReturn:
+        '''
+        Add a measure given per building (a Series indexed by centabldg) and sum it up to every level.
+        Buildings missing from leaf_values are counted as 0, values of unknown buildings are ignored.
+        '''
+        leaf_values = leaf_values.groupby(leaf_values.index.map(NormalizeCode)).sum()
+        dtype = np.int64 if pd.api.types.is_integer_dtype(leaf_values) else np.float64
+        totals = np.array(leaf_values.reindex(self.codes['centabldg'], fill_value=0), dtype=dtype)
+        self.values['centabldg'][name] = totals
+
+        # single bottom-up pass: the totals of a level are the sums of its children
+        for upper, lower in zip(LEVELS[-2::-1], LEVELS[:0:-1]):
+            totals = np.bincount(self.parent[lower], weights=totals, minlength=len(self.codes[upper])).astype(dtype)
+            self.values[upper][name] = totals
+
+    def Get(self, level: str, code: str, measure: str=BUILDING_COUNT) -> Union[int, float]:
+        '''Return the total of a measure of a single node, e.g. Get('hma', 'H001', 'units')'''
+        level = self._Level(level)
+        return self.values[level][measure][self.index[level][NormalizeCode(code)]].item()
+
+    def GetLevel(self, level: str, measure: str=BUILDING_COUNT) -> pd.Series:
+        '''Return the totals of a measure of all nodes in a level as a Series indexed by code'''
+        level = self._Level(level)
+        return pd.Series(self.values[level][measure].copy(), index=self.codes[level], name=measure)
+
+    def GetPath(self, level: str, code: str) -> Dict[str, str]:
+        '''Return the codes of a node and all its ancestors'''
+        level = self._Level(level)
+        return {lv: self.codes[lv][i] for lv, i in self._Path(level, self.index[level][NormalizeCode(code)])}
+
+    def _PromoteToFloat(self, measure: str, delta: Union[int, float]) -> NoReturn:
+        '''Change an integer measure to float at every level if delta has a fraction, which would be truncated otherwise'''
+        if np.issubdtype(self.values['centabldg'][measure].dtype, np.integer) and not float(delta).is_integer():
+            for level in LEVELS:
+                self.values[level][measure] = self.values[level][measure].astype(np.float64)
+
+    def AddToBuilding(self, centabldg: str, measure: str, delta: Union[int, float]) -> NoReturn:
+        '''
+        Change a measure of a building, e.g. when units are added or removed, and update all its ancestors.
+        An integer measure becomes float if delta has a fraction.
+        '''
+        self._PromoteToFloat(measure, delta)
+        for level, node in self._Path('centabldg', self.index['centabldg'][NormalizeCode(centabldg)]):
+            self.values[level][measure][node] += delta
+
+    def MoveUnits(self, from_centabldg: str, to_centabldg: str, measure: str, amount: Union[int, float]) -> NoReturn:
+        '''Move an amount of a measure, e.g. a number of units, from one building to another'''
+        self.AddToBuilding(from_centabldg, measure, -amount)
+        self.AddToBuilding(to_centabldg, measure, amount)
+
+    def AddNode(self, level: str, code: str, parent_code: Optional[str]=None) -> int:
+        '''
+        Add a node with zero totals under an existing parent, return the index of the new node.
+        A new building is counted in the number of buildings of itself and all its ancestors.
+        '''
+        level = self._Level(level)
+        code = NormalizeCode(code)
+        if code in self.index[level]:
+            raise ValueError("{} {} already exists".format(level, code))
+
+        depth = LEVELS.index(level)
+        parent = -1
+        if depth > 0:
+            parent = self.index[LEVELS[depth - 1]][NormalizeCode(parent_code)]
+
+        node = len(self.codes[level])
+        self.codes[level].append(code)
+        self.index[level][code] = node
+        self.parent[level] = np.append(self.parent[level], parent)
+        for measure, totals in self.values[level].items():
+            self.values[level][measure] = np.append(totals, totals.dtype.type(0))
+        if level == 'centabldg':
+            self.AddToBuilding(code, BUILDING_COUNT, 1)
+        return node
+
+    def MoveNode(self, level: str, code: str, new_parent_code: str) -> NoReturn:
+        '''
+        Move a node with all its totals under another parent, e.g. MoveNode('building', bldg, new_estate).
+        Only the totals of the old and the new ancestors are updated.
+        '''
+        level = self._Level(level)
+        depth = LEVELS.index(level)
+        if depth == 0:
+            raise ValueError("Node in the top level could not be moved")
+        node = self.index[level][NormalizeCode(code)]
+        upper = LEVELS[depth - 1]
+        new_parent = self.index[upper][NormalizeCode(new_parent_code)]
+        old_parent = self.parent[level][node]
+        if new_parent == old_parent:
+            return
+
+        for measure, totals in self.values[level].items():
+            amount = totals[node]
+            for lv, i in self._Path(upper, old_parent):
+                self.values[lv][measure][i] -= amount
+            for lv, i in self._Path(upper, new_parent):
+                self.values[lv][measure][i] += amount
+        self.parent[level][node] = new_parent
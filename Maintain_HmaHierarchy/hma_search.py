@@ -0,0 +1,247 @@
+'''An in-process search index of building / estate / street / hma names in dbo.HmaHierarchy.
+
+Instead of LIKE '%...%' scans on the view, every distinct name is split into character bigrams
+(and single characters for one-character queries) and each gram points to the names containing it.
+A query is answered by ranking the names by exact match > prefix match > substring match.
+Apart from the kind of match, the rank of a name does not depend on the query, so every posting list
+is kept sorted by that rank and a search walks the lists in order, stopping as soon as enough units are found.
+Each result carries cuntcode and the full ancestor path.
+'''
+import bisect
+import itertools
+import unicodedata
+from typing import Dict, Iterator, List, NoReturn, Optional, Set, Tuple
+
+import pandas as pd
+
+import pyodbc_sql_function as sql
+
+# columns of a unit kept in the index, i.e. the full path from territory down to the unit
+UNIT_COLUMNS = ('cuntcode', 'Territory', 'District', 'HMA', 'Street', 'cestcode', 'EstateChName',
+                'cblgcode', 'BuildingChName', 'Floor', 'Flat')
+
+# searchable columns, in the order of priority when ranking names with the same kind of match
+SEARCH_FIELDS = ('BuildingChName', 'EstateChName', 'Street', 'HMA')
+
+# HMA / Street without a meaningful name, they are suffixed with the district in the view
+OTHER_HMA = '其他'
+UNDIVIDED_STREET = '未劃分'
+PLACEHOLDER_NAMES = (OTHER_HMA, UNDIVIDED_STREET)
+
+# kinds of match, smaller is better
+EXACT_MATCH, PREFIX_MATCH, SUBSTRING_MATCH = 0, 1, 2
+
+sql_hierarchy = """
+    SELECT h.cuntcode, h.Territory, h.District, h.HMA, h.Street, h.cestcode, h.EstateChName,
+           h.cblgcode, h.BuildingChName, h.Floor, h.Flat
+    FROM dbo.HmaHierarchy h WITH (NOEXPAND)
+"""
+
+
+def NormalizeText(text) -> str:
+    '''
+    Trim the text like LTRIM(RTRIM(...)) in the view, and fold full-width characters and letter cases,
+    so that "ＡＢＣ大廈 " and "abc大廈" are the same name.
+    '''
+    if text is None or (isinstance(text, float) and text != text):
+        return ''
+    return unicodedata.normalize('NFKC', str(text)).strip().casefold()
+
+
+def ResolveHma(hma: str, district: str) -> str:
+    '''The HMA column of the view: "其他" is suffixed with its district'''
+    hma = NormalizeText(hma)
+    if hma == OTHER_HMA:
+        return "{}({})".format(hma, NormalizeText(district))
+    return hma
+
+
+def ResolveStreet(street: str, hma: str, district: str) -> str:
+    '''The Street column of the view, built from the Street, HMA and District of import.BuildingHMA'''
+    street = NormalizeText(street)
+    if street == '' or street == UNDIVIDED_STREET:
+        return "{}({})".format(UNDIVIDED_STREET, NormalizeText(district))
+    return ResolveHma(hma, district)
+
+
+def IsPlaceholder(name: str) -> bool:
+    '''Return True for names like "其他(沙田)" or "未劃分(沙田)"'''
+    return any(name == word or name.startswith(word + '(') for word in PLACEHOLDER_NAMES)
+
+
+def Grams(text: str) -> Set[str]:
+    '''Return the bigrams of a text, or the text itself if it has a single character'''
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def ResolveViewNames(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Return a copy of an extract taken from import.BuildingHMA (e.g. by GetBuildingHma),
+    with HMA and Street resolved in the same way as dbo.HmaHierarchy, so both could be searched alike.
+    '''
+    df = df.copy()
+    df['Street'] = [ResolveStreet(street, hma, district) for street, hma, district in zip(df['Street'], df['HMA'], df['District'])]
+    df['HMA'] = [ResolveHma(hma, district) for hma, district in zip(df['HMA'], df['District'])]
+    return df
+
+
+def GetHmaHierarchy(con_dict: Dict[str, str]) -> pd.DataFrame:
+    '''Return all units in dbo.HmaHierarchy with the columns needed by HmaSearchIndex'''
+    return sql.GetDataFromSqlToDF(con_dict, sql_hierarchy, False)
+
+
+def RankKey(field: str, name: str) -> Tuple[bool, int, int, str]:
+    '''The part of the rank of a name that does not depend on the query, smaller is better'''
+    return IsPlaceholder(name), SEARCH_FIELDS.index(field), len(name), name
+
+
+def _Discard(sorted_list: List, item) -> NoReturn:
+    i = bisect.bisect_left(sorted_list, item)
+    if i < len(sorted_list) and sorted_list[i] == item:
+        del sorted_list[i]
+
+
+class HmaSearchIndex:
+    '''
+    Usage:
+        index = HmaSearchIndex(GetHmaHierarchy(con_dict))
+        index.Search('太古城')        # a list of dict with cuntcode, the ancestor path, the matched field and name
+        index.Refresh(GetHmaHierarchy(con_dict))     # after the hierarchy is reloaded
+    '''
+    def __init__(self, hierarchy: Optional[pd.DataFrame]=None):
+        self.units = {}         # cuntcode -> tuple of UNIT_COLUMNS
+        self.names = []         # name id -> (field, normalized name), None if removed
+        self.name_id = {}       # (field, normalized name) -> name id
+        self.name_units = []    # name id -> sorted list of cuntcode
+        self.postings = {}      # gram -> list of (rank key, name id) sorted by rank key
+        self.prefixes = {}      # first one or two characters of names -> list of (rank key, name id) sorted by rank key
+        self._unsorted = {}     # lists appended to during a refresh, sorted at its end
+        if hierarchy is not None:
+            self.Refresh(hierarchy)
+
+    @staticmethod
+    def _Rows(hierarchy: pd.DataFrame) -> Dict[str, Tuple]:
+        df = hierarchy[list(UNIT_COLUMNS)].astype(object).where(hierarchy[list(UNIT_COLUMNS)].notna(), None)
+        return {NormalizeText(row[0]): row for row in df.itertuples(index=False, name=None)}
+
+    def _Indexes(self, name: str):
+        '''Return (index, keys) of the posting lists a name belongs to'''
+        return (self.postings, Grams(name) | set(name)), (self.prefixes, {name[:1], name[:2]})
+
+    def _Append(self, items: List, item) -> NoReturn:
+        items.append(item)
+        self._unsorted[id(items)] = items
+
+    def _AddUnit(self, cuntcode: str, row: Tuple) -> NoReturn:
+        self.units[cuntcode] = row
+        for field in SEARCH_FIELDS:
+            name = NormalizeText(row[UNIT_COLUMNS.index(field)])
+            if not name:
+                continue
+            key = (field, name)
+            name_id = self.name_id.get(key)
+            if name_id is None:
+                name_id = len(self.names)
+                self.names.append(key)
+                self.name_id[key] = name_id
+                self.name_units.append([])
+                entry = (RankKey(field, name), name_id)
+                for index, grams in self._Indexes(name):
+                    for gram in grams:
+                        self._Append(index.setdefault(gram, []), entry)
+            self._Append(self.name_units[name_id], cuntcode)
+
+    def _RemoveUnit(self, cuntcode: str) -> NoReturn:
+        # lists are sorted here, as units are removed before any unit is added in a refresh
+        row = self.units.pop(cuntcode)
+        for field in SEARCH_FIELDS:
+            name = NormalizeText(row[UNIT_COLUMNS.index(field)])
+            name_id = self.name_id.get((field, name))
+            if name_id is None:
+                continue
+            units = self.name_units[name_id]
+            _Discard(units, cuntcode)
+            if not units:
+                # the name is no longer used by any unit
+                entry = (RankKey(field, name), name_id)
+                for index, grams in self._Indexes(name):
+                    for gram in grams:
+                        _Discard(index[gram], entry)
+                        if not index[gram]:
+                            del index[gram]
+                del self.name_id[(field, name)]
+                self.names[name_id] = None
+
+    def Refresh(self, hierarchy: pd.DataFrame) -> Tuple[int, int, int]:
+        '''
+        Update the index with a new extract of the hierarchy.
+        Only units that are added, changed or removed are touched.
+        Return the number of added, changed and removed units.
+        '''
+        rows = self._Rows(hierarchy)
+        removed = [cuntcode for cuntcode in self.units if cuntcode not in rows]
+        changed = [cuntcode for cuntcode, row in rows.items() if cuntcode in self.units and self.units[cuntcode] != row]
+        added = [cuntcode for cuntcode in rows if cuntcode not in self.units]
+
+        for cuntcode in removed + changed:
+            self._RemoveUnit(cuntcode)
+        for cuntcode in changed + added:
+            self._AddUnit(cuntcode, rows[cuntcode])
+        for items in self._unsorted.values():
+            items.sort()
+        self._unsorted = {}
+        print("Search index refreshed: {} added, {} changed, {} removed, {} units".format(
+            len(added), len(changed), len(removed), len(self.units)))
+        return len(added), len(changed), len(removed)
+
+    def _IterNames(self, query: str, fields: Tuple[str, ...]) -> Iterator[Tuple[int, str, str]]:
+        '''Yield (kind of match, field, name) of the names containing a normalized query, best match first'''
+        for field in SEARCH_FIELDS:
+            if field in fields and (field, query) in self.name_id:
+                yield EXACT_MATCH, field, query
+
+        for _, name_id in self.prefixes.get(query[:2], ()):
+            field, name = self.names[name_id]
+            if field in fields and name != query and name.startswith(query):
+                yield PREFIX_MATCH, field, name
+
+        postings = [self.postings.get(gram, []) for gram in Grams(query)]
+        for _, name_id in min(postings, key=len):
+            field, name = self.names[name_id]
+            if field in fields and query in name and not name.startswith(query):
+                yield SUBSTRING_MATCH, field, name
+
+    def IterNames(self, query: str, fields: Tuple[str, ...]=SEARCH_FIELDS) -> Iterator[Tuple[int, str, str]]:
+        '''Yield (kind of match, field, name) of the names containing the query, best match first'''
+        query = NormalizeText(query)
+        if not query:
+            return iter(())
+        if not IsPlaceholder(query):
+            return self._IterNames(query, fields)
+        # placeholders are only ranked after other names when the query is not a placeholder itself,
+        # such queries match few names, so they are simply sorted
+        matches = sorted(self._IterNames(query, fields),
+                         key=lambda match: (match[0],) + RankKey(match[1], match[2])[1:])
+        return iter(matches)
+
+    def SearchNames(self, query: str, fields: Tuple[str, ...]=SEARCH_FIELDS, limit: Optional[int]=None) -> List[Tuple[int, str, str]]:
+        '''Return (kind of match, field, name) of up to limit names containing the query, best match first'''
+        return list(itertools.islice(self.IterNames(query, fields), limit))
+
+    def Search(self, query: str, limit: int=50, fields: Tuple[str, ...]=SEARCH_FIELDS) -> List[Dict[str, str]]:
+        '''Return up to limit units whose names contain the query, with their full ancestor path'''
+        results = []
+        if limit <= 0:
+            return results
+        for kind, field, name in self.IterNames(query, fields):
+            for cuntcode in self.name_units[self.name_id[(field, name)]][:limit - len(results)]:
+                result = dict(zip(UNIT_COLUMNS, self.units[cuntcode]))
+                result['matched_field'] = field
+                result['matched_name'] = name
+                result['match'] = ('exact', 'prefix', 'substring')[kind]
+                results.append(result)
+            if len(results) >= limit:
+                return results
+        return results
@@ -0,0 +1,262 @@
+'''A versioned, immutable snapshot file of the hierarchy produced by GetBuildingHma.
+
+After each successful run the job publishes a new snapshot, so other programs could read the hierarchy
+without querying SQL Server. Readers open the file with mmap and read numpy arrays directly from the mapped pages,
+so nothing is copied and all processes share the same page cache.
+
+Layout of a snapshot file:
+    8 bytes     magic b'HMASNAP1'
+    4 bytes     length of the json header (little endian)
+    header      json: version, created time, and dtype / shape / offset of each array
+    arrays      each aligned to 64 bytes, offsets are relative to the first array
+
+Arrays of each level (building --> estate --> hma --> district --> territory):
+    <level>.code    fixed-width codes, sorted, so a code is found by binary search (building, estate, hma)
+    <level>.name    id of the name in the string dictionary (hma, district, territory)
+    <level>.parent  index of the parent in the level above
+    building.street id of the street in the string dictionary
+    strings.offsets / strings.data  dictionary of utf-8 encoded names
+
+A new version is written to a temp file and renamed, then the file "CURRENT" is replaced by rename to point to it,
+so a reader always sees either the old or the new version, never a torn file.
+'''
+import datetime
+import json
+import mmap
+import os
+import struct
+from typing import Dict, List, NoReturn, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b'HMASNAP1'
+ALIGNMENT = 64
+CURRENT_FILE = 'CURRENT'
+SNAPSHOT_FILE = 'hma_hierarchy.{version}.snap'
+
+# (level, code column, name column) from the top level to the bottom level
+LEVELS = (
+    ('territory', None, 'Terr'),
+    ('district', None, 'District'),
+    ('hma', 'HMACode', 'HMA'),
+    ('estate', 'centaest', None),
+    ('building', 'centabldg', None),
+)
+
+
+def _Align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _FsyncWrite(path: str, data_parts: List[bytes]) -> NoReturn:
+    with open(path, 'wb') as f:
+        for data in data_parts:
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def BuildArrays(hierarchy: pd.DataFrame) -> Dict[str, np.ndarray]:
+    '''Convert the GetBuildingHma result into the arrays stored in a snapshot'''
+    # NULL (None or NaN) is stored as an empty string
+    df = hierarchy.apply(lambda col: col.map(lambda value: '' if pd.isna(value) else str(value).strip()))
+    df = df.drop_duplicates('centabldg')
+
+    strings = sorted(set(df['HMA']) | set(df['Street']) | set(df['District']) | set(df['Terr']))
+    string_id = {text: i for i, text in enumerate(strings)}
+    encoded = [text.encode('utf-8') for text in strings]
+    arrays = {
+        'strings.offsets': np.cumsum([0] + [len(data) for data in encoded], dtype=np.int64),
+        'strings.data': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+    }
+
+    # the key of a node is its code, or its name for levels without code
+    upper_index = None
+    for level, code_col, name_col in LEVELS:
+        key_col = code_col or name_col
+        node_index, keys = pd.factorize(df[key_col], sort=True)
+        # the first row of each node decides its parent and name, a single parent is guaranteed by GetBuildingHma
+        first_row = pd.Series(np.arange(len(df))).groupby(node_index).first().to_numpy()
+
+        if code_col is not None:
+            width = max([len(key.encode('utf-8')) for key in keys] + [1])
+            arrays[level + '.code'] = np.array([key.encode('utf-8') for key in keys], dtype='S{}'.format(width))
+        if name_col is not None:
+            arrays[level + '.name'] = np.array([string_id[name] for name in df[name_col].to_numpy()[first_row]], dtype=np.int32)
+        if upper_index is not None:
+            arrays[level + '.parent'] = upper_index[first_row].astype(np.int32)
+        upper_index = node_index
+
+    # after the loop, first_row is the row of each building
+    arrays['building.street'] = np.array([string_id[street] for street in df['Street'].to_numpy()[first_row]], dtype=np.int32)
+    return arrays
+
+
+def CurrentVersion(snapshot_dir: str) -> Optional[str]:
+    '''Return the file name of the current snapshot, None if nothing is published yet'''
+    try:
+        with open(os.path.join(snapshot_dir, CURRENT_FILE), encoding='utf-8') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def PublishSnapshot(hierarchy: pd.DataFrame, snapshot_dir: str, keep: int=3) -> str:
+    '''
+    Write a new version of the snapshot and make it current. Return the path of the new snapshot.
+    Only the latest "keep" versions are kept; older files still opened by a reader are left for the next run.
+    '''
+    os.makedirs(snapshot_dir, exist_ok=True)
+    created = datetime.datetime.now()
+    version = created.strftime('%Y%m%d%H%M%S%f')
+    arrays = BuildArrays(hierarchy)
+
+    sections = {}
+    parts = []
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        padding = _Align(offset) - offset
+        if padding:
+            parts.append(b'\0' * padding)
+        offset += padding
+        sections[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        parts.append(array.tobytes())
+        offset += array.nbytes
+
+    header = json.dumps({'version': version, 'created': created.isoformat(), 'sections': sections}).encode('utf-8')
+    preamble = MAGIC + struct.pack('<I', len(header)) + header
+    preamble += b'\0' * (_Align(len(preamble)) - len(preamble))
+
+    file_name = SNAPSHOT_FILE.format(version=version)
+    path = os.path.join(snapshot_dir, file_name)
+    _FsyncWrite(path + '.tmp', [preamble] + parts)
+    os.replace(path + '.tmp', path)
+
+    current_path = os.path.join(snapshot_dir, CURRENT_FILE)
+    _FsyncWrite(current_path + '.tmp', [file_name.encode('utf-8')])
+    os.replace(current_path + '.tmp', current_path)
+    print("Published hierarchy snapshot {} ({} bytes)".format(path, len(preamble) + offset))
+
+    snapshots = sorted(f for f in os.listdir(snapshot_dir) if f.startswith('hma_hierarchy.') and f.endswith('.snap'))
+    for old_file in snapshots[:-keep]:
+        try:
+            os.remove(os.path.join(snapshot_dir, old_file))
+        except OSError:
+            # on windows, a file mapped by a reader could not be removed
+            pass
+    return path
+
+
+class HierarchySnapshot:
+    '''
+    A read-only view of a snapshot file. Arrays are numpy views on the mapped file.
+    The accessors (String, Find, Path, GetBuilding, ToDataFrame) return copies. A caller taking arrays from
+    "arrays" directly keeps the file mapped until those arrays are released, even after Close.
+
+    Usage:
+        snapshot = HierarchySnapshot.OpenCurrent(snapshot_dir)
+        snapshot.GetBuilding('B000000001')      # codes and names from the building up to the territory
+        if not snapshot.IsCurrent():
+            snapshot = snapshot.Reopen()
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self.snapshot_dir = os.path.dirname(path)
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError("{} is not a hierarchy snapshot".format(path))
+        header_len = struct.unpack_from('<I', self._mmap, len(MAGIC))[0]
+        header_start = len(MAGIC) + 4
+        header = json.loads(self._mmap[header_start:header_start + header_len].decode('utf-8'))
+        data_start = _Align(header_start + header_len)
+
+        self.version = header['version']
+        self.created = header['created']
+        self.arrays = {}
+        for name, section in header['sections'].items():
+            dtype = np.dtype(section['dtype'])
+            count = int(np.prod(section['shape']))
+            self.arrays[name] = np.frombuffer(self._mmap, dtype=dtype, count=count,
+                                              offset=data_start + section['offset']).reshape(section['shape'])
+
+    @classmethod
+    def OpenCurrent(cls, snapshot_dir: str) -> 'HierarchySnapshot':
+        version = CurrentVersion(snapshot_dir)
+        if version is None:
+            raise FileNotFoundError("No snapshot is published in {}".format(snapshot_dir))
+        return cls(os.path.join(snapshot_dir, version))
+
+    def IsCurrent(self) -> bool:
+        return CurrentVersion(self.snapshot_dir) == os.path.basename(self.path)
+
+    def Reopen(self) -> 'HierarchySnapshot':
+        '''Open the current version and close this one'''
+        snapshot = HierarchySnapshot.OpenCurrent(self.snapshot_dir)
+        self.Close()
+        return snapshot
+
+    def Close(self) -> NoReturn:
+        # views on the mapped memory have to be released before the map could be closed
+        self.arrays = {}
+        try:
+            self._mmap.close()
+        except BufferError:
+            # arrays still held by the caller point to the map, it is unmapped when the last of them is released
+            pass
+        self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.Close()
+
+    def String(self, string_id: int) -> str:
+        offsets = self.arrays['strings.offsets']
+        return self.arrays['strings.data'][offsets[string_id]:offsets[string_id + 1]].tobytes().decode('utf-8')
+
+    def Find(self, level: str, code: str) -> int:
+        '''Return the index of a code in a level (building, estate or hma) by binary search, -1 if not found'''
+        codes = self.arrays[level + '.code']
+        key = code.strip().encode('utf-8')
+        if len(key) > codes.dtype.itemsize:
+            return -1
+        key = np.array(key, dtype=codes.dtype)
+        i = int(np.searchsorted(codes, key))
+        if i < len(codes) and codes[i] == key:
+            return i
+        return -1
+
+    def Path(self, level: str, index: int) -> List[Tuple[str, int]]:
+        '''Return (level, index) of a node and all its ancestors'''
+        depth = [lv for lv, _, _ in LEVELS].index(level)
+        path = [(level, index)]
+        while depth > 0:
+            index = int(self.arrays[LEVELS[depth][0] + '.parent'][index])
+            depth -= 1
+            path.append((LEVELS[depth][0], index))
+        return path
+
+    def GetBuilding(self, centabldg: str) -> Optional[Dict[str, str]]:
+        '''Return the columns of GetBuildingHma for a building, None if not found'''
+        index = self.Find('building', centabldg)
+        if index < 0:
+            return None
+        path = dict(self.Path('building', index))
+        return {
+            'centaest': self.arrays['estate.code'][path['estate']].decode('utf-8'),
+            'centabldg': self.arrays['building.code'][index].decode('utf-8'),
+            'HMACode': self.arrays['hma.code'][path['hma']].decode('utf-8'),
+            'HMA': self.String(self.arrays['hma.name'][path['hma']]),
+            'Street': self.String(self.arrays['building.street'][index]),
+            'District': self.String(self.arrays['district.name'][path['district']]),
+            'Terr': self.String(self.arrays['territory.name'][path['territory']]),
+        }
+
+    def ToDataFrame(self) -> pd.DataFrame:
+        '''Return all buildings in the same format as GetBuildingHma'''
+        return pd.DataFrame([self.GetBuilding(code.decode('utf-8')) for code in self.arrays['building.code']])
@@ -1,11 +1,19 @@
-﻿import pyodbc_sql_function as sql
-from send_email_function import write_email, send_email
-from typing import Tuple, List, Dict, Union
-import pandas as pd
+﻿from __future__ import annotations
+
+import pyodbc_sql_function as sql
+from job_runner import stage
+from .send_email_function import write_email, BackgroundEmailSender
+from typing import Tuple, List, Dict, Union, Optional, TYPE_CHECKING
 import datetime
+import csv
+import gzip
+import os
+import tempfile
 from prettytable import PrettyTable
-from sqlalchemy import create_engine
-from sqlalchemy.types import NVARCHAR, CHAR
+
+# pandas, numpy and sqlalchemy are only imported when the job runs, see pyodbc_sql_function
+if TYPE_CHECKING:
+    import pandas as pd
 
 '''The purpose of this program is to form a hierarchy based on geographical location of different real-estates.
 The structure of the hierarchy would be as follow: unit --> building --> estate --> hma --> district --> territory
@@ -47,12 +55,21 @@ checklist_error_msg_map = {
     'bldg_est': "The following BUILDING are pointing to multiple ESTATE:"
 }
 
+# maximum number of troublesome cases of each test to be listed in the email body
+# the full list would be attached to the email as a gzip csv file
+max_inline_cases = 20
+
+# every test returns at most 2 columns, so all cases fit in one table: check_item, col_1, col_2
+csv_case_columns = 2
+csv_header = ['check_item'] + ['col_{}'.format(i + 1) for i in range(csv_case_columns)]
+
 
 #--------------------------function definition-----------------------------------------------------------
-def ValidateDataByTest(con: Dict[str, str], check_item: str) -> Tuple[bool, str]:
+def ValidateDataByTest(con: Dict[str, str], check_item: str, csv_writer=None, max_inline: int=max_inline_cases) -> Tuple[bool, str]:
     '''
     Return a bool to indicate if data in BuildingHma pass a single sql-based test
-    If not pass, a pretty table in str format would be returned to list all those troublesome cases.
+    If not pass, a pretty table in str format would be returned to list the first few troublesome cases.
+    All troublesome cases would be written to csv_writer if provided, as rows of csv_header.
     '''
     sql_string = checklist_sql_statement_map[check_item]
     data, col_name = sql.ExecQuery(con, sql_string, False, False)
@@ -63,29 +80,49 @@ def ValidateDataByTest(con: Dict[str, str], check_item: str) -> Tuple[bool, str]
         return True, None
     else:
         # This means a subsidary belongs to more than one superior units
-        print("Test Case: {} FAILED".format(check_item))
+        print("Test Case: {} FAILED ({} cases)".format(check_item, len(data)))
+        if csv_writer is not None:
+            if len(col_name) > csv_case_columns:
+                raise ValueError("Test {} returns {} columns, at most {} could be written to the csv".format(check_item, len(col_name), csv_case_columns))
+            padding = [''] * (csv_case_columns - len(col_name))
+            for row in data:
+                csv_writer.writerow([check_item] + list(row) + padding)
+
         table = PrettyTable(col_name)
-        for row in data:
+        for row in data[:max_inline]:
             table.add_row(row)
-        return False, table.get_html_string()
+        table_html = table.get_html_string()
+        if len(data) > max_inline:
+            table_html = table_html + '<br/>Only the first {} of {} cases are listed. Please refer to the attachment for the full list.'.format(max_inline, len(data))
+        return False, table_html
 
 
-def ValidateData(con_dict: Dict[str,str], check_list: Union[Tuple[str],List[str]], win_auth: bool=False) -> Tuple[bool, str]:
+def ValidateData(con_dict: Dict[str,str], check_list: Union[Tuple[str],List[str]], win_auth: bool=False) -> Tuple[bool, str, Optional[str]]:
     '''
     Return a boolean to indicate whether all tests have been passed
     Return a string which would be the content of the notification email
+    Return the path of a gzip csv file listing all troublesome cases, None if all tests have been passed
     '''
     start_time = datetime.datetime.now()
     email_body = """<p>The job for updating HmaHierarchy has been suspended at {}</p>""".format(start_time)
     IsPassAll = True
-    for item in check_list:
-        is_pass, error_case = ValidateDataByTest(con=con_dict, check_item=item)
-        if not is_pass:
-            email_body = email_body + '<br/>' + checklist_error_msg_map[item] + '<br/>' + error_case + '<br/>'
-            IsPassAll = False
+
+    attachment_path = os.path.join(tempfile.gettempdir(), "HmaHierarchy_failed_cases_{}.csv.gz".format(start_time.strftime("%Y%m%d%H%M%S")))
+    with gzip.open(attachment_path, 'wt', newline='', encoding='utf-8-sig') as f:
+        csv_writer = csv.writer(f)
+        csv_writer.writerow(csv_header)
+        for item in check_list:
+            is_pass, error_case = ValidateDataByTest(con=con_dict, check_item=item, csv_writer=csv_writer)
+            if not is_pass:
+                email_body = email_body + '<br/>' + checklist_error_msg_map[item] + '<br/>' + error_case + '<br/>'
+                IsPassAll = False
+
+    if IsPassAll:
+        os.remove(attachment_path)
+        attachment_path = None
     print("IsPassAll: {}".format(IsPassAll))
     print("Email Body:\n {}".format(email_body))
-    return IsPassAll, email_body
+    return IsPassAll, email_body, attachment_path
 
 
 def GetBuildingHma(con_dict: Dict[str, str], win_auth: bool=False) -> pd.DataFrame:
@@ -176,29 +213,14 @@ def main():
                               'pw': 'pw'
                               }
 
-    # connect url used by sqlalchemy engine
-    con_url = "mssql+pyodbc://{user}:{pw}@{server}/{db}?driver=SQL+Server+Native+Client+11.0"
-    con_url_test = con_url.format(user=con_dict_agentext_test['user'], pw=con_dict_agentext_test['pw'],
-                             server=con_dict_agentext_test['server'], db=con_dict_agentext_test['db'])
-
     # create engine for destination db
-    dest_engine_test = create_engine(con_url_test)
-
-    # parameter for email
-    subject = "Suspension in Updating HMAHierarchy at {}".format(start_time)
-    sender = "server@testing.com"
-    to = ["receiver@testing.com"]
+    dest_engine_test = sql.GetEngine(con_dict_agentext_test)
 
-    # start validating data in building hma
-    pass_all_test, email_body = ValidateData(con_dict_source, check_list, False)
+    # directory of the hierarchy snapshot files, see hma_snapshot
+    snapshot_dir = 'hma_snapshot'
 
-    # send email problem still exists in the data
-    if not pass_all_test:
-        send_email(write_email(subject, email_body, sender, to, None, None))
-
-    # extract hmahierarchy for insertion
-    df_for_insert = GetBuildingHma(con_dict_source, win_auth=False)
-    print(df_for_insert)
+    from sqlalchemy.types import NVARCHAR, CHAR
+    from .hma_snapshot import PublishSnapshot
 
     table_def = {'centaest': CHAR(10),
                  'centabldg': CHAR(10),
@@ -244,15 +266,54 @@ def main():
     sql_cindex = "create unique clustered index UCIX_v_HmaHierarchy on dbo.HmaHierarchy (cuntcode)"
     sql_index = "create index IX_v_HmaHierarchy_Terr_District_HMA_Street_cest_cblg_cunt on dbo.HmaHierarchy (Territory, District, HMA, Street, cestcode, cblgcode, cuntcode) include (EstateChName, BuildingChName, Floor, Flat)"
 
-    print("Start Inserting into Development Environment")
-    con = sql.DropView(sql.DelTable(con_dict_agentext_test, 'BuildingHMA', 'import', True), 'HmaHierarchy', 'dbo', False)
-    sql.InsertDFtoDB('BuildingHMA', 'import', df_for_insert, table_def, None, dest_engine_test)
-
-    con = sql.ExecNonQuerySQL(con_dict_agentext_test, sql_create_view, True)
-    sql.ExecNonQuerySQL(sql.ExecNonQuerySQL(con, sql_cindex, True), sql_index, False)
+    # parameter for email
+    subject = "Suspension in Updating HMAHierarchy at {}".format(start_time)
+    sender = "server@testing.com"
+    to = ["receiver@testing.com"]
 
+    # emails are sent in background so that the extraction would not wait for the smtp server
+    email_sender = BackgroundEmailSender('mail.testing.com', 25)
+
+    # the sender is closed even if a later stage fails, so a queued email is still sent before the job ends
+    try:
+        # start validating data in building hma
+        with stage("validate"):
+            pass_all_test, email_body, attachment_path = ValidateData(con_dict_source, check_list, False)
+
+        # send email problem still exists in the data
+        if not pass_all_test:
+            email_sender.submit(write_email(subject, email_body, sender, to, attachment_path, os.path.basename(attachment_path)))
+            os.remove(attachment_path)
+
+        # extract hmahierarchy for insertion
+        # the extract is kept until it is fully loaded, so a rerun after failure would resume the load without extracting again
+        with stage("extract"):
+            df_for_insert = sql.GetCachedExtract('import.BuildingHMA', lambda: GetBuildingHma(con_dict_source, win_auth=False))
+        print(df_for_insert)
+
+        print("Start Inserting into Development Environment")
+        # the view is schema bound to import.BuildingHMA, so it has to be dropped before loading
+        # each chunk is committed with a checkpoint, so a rerun would continue from the last committed chunk
+        # duplicate keys are possible when the bldg_est test fails, they are refused before the view is dropped
+        with stage("load"):
+            sql.CheckUniqueKeys(df_for_insert, ['centaest', 'centabldg'], load_name='import.BuildingHMA')
+            sql.DropView(con_dict_agentext_test, 'HmaHierarchy', 'dbo', False)
+            sql.InsertDFtoDBChunked('BuildingHMA', 'import', df_for_insert, ['centaest', 'centabldg'], table_def, engine=dest_engine_test)
+
+        with stage("create_view"):
+            con = sql.ExecNonQuerySQL(con_dict_agentext_test, sql_create_view, True)
+            sql.ExecNonQuerySQL(sql.ExecNonQuerySQL(con, sql_cindex, True), sql_index, False)
+
+        # publish the hierarchy for other programs, which map the snapshot file instead of querying the database
+        with stage("snapshot"):
+            PublishSnapshot(df_for_insert, snapshot_dir)
+
+    finally:
+        for msg in email_sender.close():
+            print("Email is not sent: {}".format(msg['Subject']))
 
     print("Start Time: ", start_time)
     print("End Time: ", datetime.datetime.now())
 
-main()
+if __name__ == '__main__':
+    main()
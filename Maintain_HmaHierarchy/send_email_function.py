@@ -1,10 +1,34 @@
-from smtplib import SMTP
+from smtplib import SMTP, SMTPServerDisconnected
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email.message import EmailMessage
-from email import encoders
 from typing import Union, List, Dict, NoReturn, Optional
+import base64
+import os
+import queue
+import threading
+
+# size of each block read from an attachment before base64 encoding.
+# 57 bytes encode to exactly one 76-character MIME line, so every chunk ends on a line boundary.
+ATTACHMENT_CHUNK_SIZE = 57 * 1024
+
+
+def EncodeAttachment(attachment_path: str, chunk_size: int=ATTACHMENT_CHUNK_SIZE) -> str:
+    '''
+    Return the base64 encoded content of a file.
+    The file is read and encoded chunk by chunk, but the encoded content is returned as a single string
+    because the email package needs the whole payload of a part when the message is sent.
+    '''
+    encoded_chunks = []
+    with open(attachment_path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            encoded_chunks.append(base64.encodebytes(chunk).decode('ascii'))
+    return "".join(encoded_chunks)
+
 
 def write_email(subject: str, content: str, sender: str, receiver_list: List[str], attachment_path: str=None, attachment_name: str=None) -> MIMEMultipart:
     print("Writing Email")
@@ -14,7 +38,7 @@ def write_email(subject: str, content: str, sender: str, receiver_list: List[str
     msg['From'] = sender
     msg['To'] = ", ".join(receiver_list)
 
-    # Set email message    
+    # Set email message
     combine_html = """
     <html>
       <head></head>
@@ -28,19 +52,99 @@ def write_email(subject: str, content: str, sender: str, receiver_list: List[str
     """.format(html=content)
     html_content = MIMEText(combine_html, 'html')
     msg.attach(html_content)
-    print(html_content)
+    print("Email body: {} characters".format(len(combine_html)))
 
     # Add attachement
     if attachment_path is not None:
+        if attachment_name is None:
+            attachment_name = os.path.basename(attachment_path)
         part = MIMEBase('application', "octet-stream")
-        part.set_payload(open(attachment_path, "rb").read())
-        encoders.encode_base64(part)
+        part.set_payload(EncodeAttachment(attachment_path))
+        part['Content-Transfer-Encoding'] = 'base64'
         part.add_header('Content-Disposition', 'attachment; filename="{file}"'.format(file=attachment_name))
         msg.attach(part)
+        print("Attachment: {} ({} bytes)".format(attachment_name, os.path.getsize(attachment_path)))
     return msg
 
 
-def send_email(msg: MIMEMultipart) -> NoReturn:
-    with SMTP('mail.testing.com', 25) as s:
+def send_email(msg: MIMEMultipart, host: str='mail.testing.com', port: int=25) -> NoReturn:
+    with SMTP(host, port) as s:
         s.send_message(msg)
         print("Email is sent.")
+
+
+class BackgroundEmailSender:
+    '''
+    Send emails from a background thread so that the caller would not be blocked by the smtp server.
+    A single smtp connection is opened on the first email and reused for all following emails.
+    If the server drops the connection, it would be reopened once before the email is given up.
+
+    Usage:
+        email_sender = BackgroundEmailSender('mail.testing.com', 25)
+        email_sender.submit(write_email(...))
+        ...
+        email_sender.close()    # wait until all submitted emails are sent
+    '''
+    def __init__(self, host: str='mail.testing.com', port: int=25, timeout: float=60):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.failed = []
+        self._queue = queue.Queue()
+        self._smtp = None
+        self._thread = threading.Thread(target=self._run, name="BackgroundEmailSender", daemon=True)
+        self._thread.start()
+
+    def submit(self, msg: MIMEMultipart) -> NoReturn:
+        '''Queue an email for sending and return immediately'''
+        self._queue.put(msg)
+
+    def close(self, timeout: Optional[float]=None) -> List[MIMEMultipart]:
+        '''
+        Wait for all queued emails to be sent and close the smtp connection.
+        A list of emails that could not be sent would be returned.
+        '''
+        self._queue.put(None)
+        self._thread.join(timeout)
+        return self.failed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _connect(self) -> SMTP:
+        if self._smtp is None:
+            self._smtp = SMTP(self.host, self.port, timeout=self.timeout)
+        return self._smtp
+
+    def _disconnect(self) -> NoReturn:
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                self._smtp.close()
+            self._smtp = None
+
+    def _send(self, msg: MIMEMultipart) -> NoReturn:
+        try:
+            self._connect().send_message(msg)
+        except SMTPServerDisconnected:
+            # the reused connection may have been closed by the server while idle
+            self._smtp = None
+            self._connect().send_message(msg)
+
+    def _run(self) -> NoReturn:
+        while True:
+            msg = self._queue.get()
+            if msg is None:
+                break
+            try:
+                self._send(msg)
+                print("Email is sent: {}".format(msg['Subject']))
+            except Exception as e:
+                print("Fail to send email: {} ({})".format(msg['Subject'], e))
+                self.failed.append(msg)
+                self._disconnect()
+        self._disconnect()
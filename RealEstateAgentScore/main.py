@@ -2,12 +2,37 @@
     Then, the obtained list of cenunits and agents would be export to another database for score calculation
 '''
 
+from __future__ import annotations
+
 import pyodbc_sql_function as sql
-import pandas as pd
+from job_runner import stage
 import datetime
-from sqlalchemy import create_engine
-from sqlalchemy.types import SMALLINT, NVARCHAR  
-from typing import Dict, List, Union, Tuple, NoReturn, Optional
+from typing import Dict, List, Union, Tuple, NoReturn, Optional, TYPE_CHECKING
+
+# pandas and sqlalchemy are only imported when the job runs, see pyodbc_sql_function
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+def ExtractDataForScore(con_dict_source1: Dict[str, str], con_dict_source2: Dict[str, str]) -> pd.DataFrame:
+    '''Return the key form data of the real-estates that are currently advertised'''
+    # start getting data from source1_server
+    print("Getting centascore data from source1")
+    with stage("extract_centascore"):
+        sql_string = "execute dbo.ExportCentaScoreData"
+        key_form_data = sql.GetDataFromSqlToDF(con_dict_source1, sql_string, win_auth=False)
+    
+    # start getting currently posted real-estate's code from source2_server
+    print("Getting cuntcode from source2")
+    with stage("extract_post"):
+        sql_string = "SELECT P.cuntcode FROM oto.Post P GROUP BY P.cuntcode"
+        cuntcode = sql.GetDataFromSqlToDF(con_dict_source2, sql_string, win_auth=False)
+    
+    # join data from the 2 sources on cuntcode
+    with stage("join"):
+        df = key_form_data.join(cuntcode.set_index('cuntcode'), how='inner', on='cuntcode', lsuffix='_left', rsuffix='_right')
+    print("Finish Joining")
+    return df
 
 
 def main():
@@ -34,6 +59,8 @@ def main():
                         'pw': 'pw'
                         }
 
+    from sqlalchemy.types import SMALLINT, NVARCHAR
+
     schema_def = {'cuntcode': NVARCHAR(40),
                   'StatusCategory': SMALLINT(),
                   'StatusCategoryName': NVARCHAR(40),
@@ -45,27 +72,20 @@ def main():
         }
 
 
-    # start getting data from source1_server
-    print("Getting centascore data from source1")
-    sql_string = "execute dbo.ExportCentaScoreData"
-    key_form_data = sql.GetDataFromSqlToDF(con_dict_source1, sql_string, win_auth=False)
-    
-    # start getting currently posted real-estate's code from source2_server
-    print("Getting cuntcode from source2")
-    sql_string = "SELECT P.cuntcode FROM oto.Post P GROUP BY P.cuntcode"
-    cuntcode = sql.GetDataFromSqlToDF(con_dict_source2, sql_string, win_auth=False)
-    
-    # join data from the 2 sources on cuntcode
-    df = key_form_data.join(cuntcode.set_index('cuntcode'), how='inner', on='cuntcode', lsuffix='_left', rsuffix='_right')
-    print("Finish Joining")
+    # the extract is kept until it is fully loaded, so a rerun after failure would resume the load without extracting again
+    df = sql.GetCachedExtract('centanet.DataForScore', lambda: ExtractDataForScore(con_dict_source1, con_dict_source2))
     print(df)
-    
+
     # start insertion to db
-    ctpost_engine_dev = create_engine("mssql+pyodbc://user:pw@destination_server/destionation_db?driver=SQL+Server+Native+Client+11.0")
-    sql.DelTable(con_dict_dest, 'DataForScore', 'centanet', False, False)
-    sql.InsertDFtoDB(table='DataForScore', schema='centanet', dataframe=df, dtype=schema_def, con=None, engine=ctpost_engine_dev)
+    # each chunk is committed with a checkpoint, so a rerun would continue from the last committed chunk
+    with stage("load"):
+        ctpost_engine_dev = sql.GetEngine(con_dict_dest)
+        sql.InsertDFtoDBChunked(table='DataForScore', schema='centanet', dataframe=df, key_columns=['cuntcode'],
+                                dtype=schema_def, engine=ctpost_engine_dev)
 
     print("Start Time: ", start_time)
     print("End Time: ", datetime.datetime.now())
 
-main()
\ No newline at end of file
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,9 @@
+"""
+A long-lived process that runs the jobs of this repository on cron-style schedules,
+instead of starting a new python process for every job from the window task scheduler.
+
+Jobs mark their stages with "stage", which is a simple timer when the job is started on its own.
+"""
+from .schedule import CronSchedule
+from .stages import stage, JobBudgetExceeded, RunContext, CurrentRun
+from .runner import JobSpec, JobRunner, SharedCache, shared_cache, PRELOAD_MODULES
@@ -0,0 +1,41 @@
+''' Start the resident runner with the jobs of this repository.
+
+Usage (from the root of the repository):
+    python -m job_runner                       # run the jobs on their schedules
+    python -m job_runner --once RealEstateAgentScore     # run a single job now and exit
+'''
+import argparse
+
+from .runner import JobSpec, JobRunner
+
+JOBS = (
+    JobSpec('HmaHierarchy', 'Maintain_HmaHierarchy.main:main', '0 3 * * *', max_concurrency=1, max_runtime=2 * 60 * 60,
+            query_deadline=30 * 60),
+    JobSpec('RealEstateAgentScore', 'RealEstateAgentScore.main:main', '30 3 * * *', max_concurrency=1, max_runtime=60 * 60,
+            query_deadline=30 * 60),
+    # a one-off fix driven by video.xlsx, only run on demand with --once
+    JobSpec('FixVideoDescription', 'FixVideoDescription.fix_video_description:main', None, max_concurrency=1, max_runtime=30 * 60),
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--once', metavar='JOB', help="run a single job immediately and exit")
+    parser.add_argument('--history', default='job_runner_history.jsonl', help="file to append the run history to")
+    parser.add_argument('--workers', type=int, default=4, help="number of jobs allowed to run at the same time")
+    args = parser.parse_args()
+
+    runner = JobRunner(JOBS, history_path=args.history, max_workers=args.workers)
+    runner.Preload()
+    if args.once:
+        runner.RunJob(runner.jobs[args.once])
+        return
+
+    try:
+        runner.RunForever()
+    except KeyboardInterrupt:
+        runner.Stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+import collections
+import datetime
+import importlib
+import json
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, NoReturn, Optional, Sequence, Any
+
+from pyodbc_sql_function.profiling import Profiling, QueryDeadlineExceeded
+
+from .schedule import CronSchedule
+from .stages import RunContext, SetCurrentRun, JobBudgetExceeded
+
+# modules imported once when the runner starts, so that no job pays for them
+PRELOAD_MODULES = ('pyodbc', 'pandas', 'sqlalchemy', 'prettytable', 'pyodbc_sql_function')
+
+
+def ImportTarget(target: str) -> Callable[[], Any]:
+    '''Return the function referred by "package.module:function"'''
+    module_name, func_name = target.split(':')
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+class JobSpec:
+    '''
+    The definition of a scheduled job.
+    target: "package.module:function" to be called without argument, e.g. "RealEstateAgentScore.main:main"
+    schedule: a cron expression, see CronSchedule, or None for a job only run on demand (e.g. "--once")
+    max_concurrency: number of runs of this job allowed at the same time, a run is skipped if the limit is reached
+    max_runtime, max_memory_mb: budgets checked at the start of every stage of the job, see RunContext
+    profile, capture_plan: capture STATISTICS IO / TIME and the actual plan of every statement, see pyodbc_sql_function.profiling
+    query_deadline: seconds a single query of the job could run before it is cancelled
+    '''
+    def __init__(self, name: str, target: str, schedule: Optional[str], max_concurrency: int=1,
+                 max_runtime: Optional[float]=None, max_memory_mb: Optional[float]=None,
+                 profile: bool=False, capture_plan: bool=False, query_deadline: Optional[float]=None):
+        self.name = name
+        self.target = target
+        self.schedule = CronSchedule(schedule) if schedule is not None else None
+        self.max_concurrency = max_concurrency
+        self.max_runtime = max_runtime
+        self.max_memory_mb = max_memory_mb
+        self.profile = profile
+        self.capture_plan = capture_plan
+        self.query_deadline = query_deadline
+        self.func = None
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+
+
+class SharedCache:
+    '''
+    A thread-safe cache of reference data shared by all jobs in the runner.
+    The loader is only called when the key is missing or older than ttl seconds.
+    Each key has its own lock, so a slow loader only blocks the jobs waiting for the same key.
+    '''
+    def __init__(self):
+        self._data = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def _Fresh(self, key: str, ttl: Optional[float]) -> bool:
+        if key not in self._data:
+            return False
+        return ttl is None or time.monotonic() - self._data[key][1] < ttl
+
+    def GetOrLoad(self, key: str, loader: Callable[[], Any], ttl: Optional[float]=None) -> Any:
+        with self._lock:
+            if self._Fresh(key, ttl):
+                return self._data[key][0]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # another job may have loaded the key while waiting for the lock
+            with self._lock:
+                if self._Fresh(key, ttl):
+                    return self._data[key][0]
+            value = loader()
+            with self._lock:
+                self._data[key] = (value, time.monotonic())
+            return value
+
+    def Invalidate(self, key: Optional[str]=None) -> NoReturn:
+        '''Remove a single key, or everything if key is not given'''
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+
+# cache shared by the jobs started by the runner
+shared_cache = SharedCache()
+
+
+class JobRunner:
+    '''
+    A long-lived process that runs jobs on their cron schedules.
+    Imports are done once at start. Since the process stays alive, the odbc connection pool (pyodbc.pooling is on by default)
+    and the engines cached by pyodbc_sql_function.GetEngine let back-to-back jobs reuse connections instead of logging in again.
+
+    Every run is appended to the run history file as a line of json with the timing of each stage.
+    '''
+    def __init__(self, jobs: Sequence[JobSpec], history_path: str='job_runner_history.jsonl',
+                 max_workers: int=4, history_size: int=200, query_profile_path: str='query_profile.jsonl'):
+        self.jobs = {job.name: job for job in jobs}
+        self.history_path = history_path
+        self.query_profile_path = query_profile_path
+        self.history = collections.deque(maxlen=history_size)
+        self._history_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._stop = threading.Event()
+
+    def Preload(self, modules: Sequence[str]=PRELOAD_MODULES) -> NoReturn:
+        '''Import the heavy libraries and the job functions before the first schedule'''
+        start = time.perf_counter()
+        for module in modules:
+            importlib.import_module(module)
+        for job in self.jobs.values():
+            job.func = ImportTarget(job.target)
+        print("Preloaded {} modules and {} jobs in {:.2f}s".format(len(modules), len(self.jobs), time.perf_counter() - start))
+
+    def Submit(self, name: str, scheduled: Optional[datetime.datetime]=None):
+        '''Start a run of a job in background, return a future of its run record'''
+        return self._executor.submit(self.RunJob, self.jobs[name], scheduled)
+
+    def RunJob(self, job: JobSpec, scheduled: Optional[datetime.datetime]=None) -> Dict[str, Any]:
+        '''Run a job in the current thread and return its run record'''
+        record = {'job': job.name,
+                  'scheduled': scheduled.isoformat() if scheduled else None,
+                  'started': datetime.datetime.now().isoformat(),
+                  'finished': None,
+                  'status': None,
+                  'seconds': None,
+                  'stages': [],
+                  'peak_memory_mb': None,
+                  'error': None}
+
+        if not job.slots.acquire(blocking=False):
+            record['status'] = 'skipped'
+            record['seconds'] = 0
+            record['error'] = "{} runs are already in progress".format(job.max_concurrency)
+            self._AddHistory(record)
+            return record
+
+        run = RunContext(max_runtime=job.max_runtime, max_memory_mb=job.max_memory_mb)
+        SetCurrentRun(run)
+        try:
+            if job.func is None:
+                job.func = ImportTarget(job.target)
+            if job.profile or job.capture_plan or job.query_deadline is not None:
+                with Profiling(job.name, history_path=self.query_profile_path, capture_stats=job.profile,
+                               capture_plan=job.capture_plan, deadline=job.query_deadline):
+                    job.func()
+            else:
+                job.func()
+            record['status'] = 'success'
+        except JobBudgetExceeded as e:
+            record['status'] = 'budget_exceeded'
+            record['error'] = str(e)
+        except QueryDeadlineExceeded as e:
+            record['status'] = 'query_deadline_exceeded'
+            record['error'] = str(e)
+        except Exception:
+            record['status'] = 'failed'
+            record['error'] = traceback.format_exc()
+        finally:
+            SetCurrentRun(None)
+            job.slots.release()
+
+        record['finished'] = datetime.datetime.now().isoformat()
+        record['seconds'] = round(time.perf_counter() - run.start, 3)
+        record['stages'] = [{'stage': name, 'seconds': round(seconds, 3)} for name, seconds in run.stages]
+        run.SampleMemory()
+        record['peak_memory_mb'] = round(run.peak_memory_mb, 1) if run.peak_memory_mb is not None else None
+        self._AddHistory(record)
+        return record
+
+    def _AddHistory(self, record: Dict[str, Any]) -> NoReturn:
+        print("Job {job} {status} ({seconds}s)".format(**record))
+        with self._history_lock:
+            self.history.append(record)
+            with open(self.history_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def RunForever(self) -> NoReturn:
+        '''Start the jobs on their schedules until Stop is called'''
+        now = datetime.datetime.now()
+        next_runs = {name: job.schedule.NextAfter(now) for name, job in self.jobs.items() if job.schedule is not None}
+        for name, next_run in next_runs.items():
+            print("Job {} is scheduled at {}".format(name, next_run))
+
+        while not self._stop.is_set():
+            if not next_runs:
+                self._stop.wait(60)
+                continue
+            name = min(next_runs, key=next_runs.get)
+            wait = (next_runs[name] - datetime.datetime.now()).total_seconds()
+            if wait > 0:
+                # wake up at least every minute, so that a change of system clock would be noticed
+                self._stop.wait(min(wait, 60))
+                continue
+            self.Submit(name, next_runs[name])
+            # schedules missed while the runner was busy are not run again
+            next_runs[name] = self.jobs[name].schedule.NextAfter(max(next_runs[name], datetime.datetime.now()))
+        self._executor.shutdown(wait=True)
+
+    def Stop(self) -> NoReturn:
+        self._stop.set()
@@ -0,0 +1,95 @@
+import datetime
+from typing import Set
+
+
+# (name, minimum, maximum) of each field of a cron expression
+CRON_FIELDS = (
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day', 1, 31),
+    ('month', 1, 12),
+    ('weekday', 0, 6),
+)
+
+
+def ParseCronField(field: str, minimum: int, maximum: int) -> Set[int]:
+    '''
+    Return the set of values allowed by a single cron field.
+    "*", "5", "1-5", "*/15", "1-31/2" and comma separated lists of them are supported.
+    '''
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step_str = part.split('/')
+            step = int(step_str)
+            if step <= 0:
+                raise ValueError("Step of cron field must be positive: {}".format(field))
+
+        if part == '*':
+            start, end = minimum, maximum
+        elif '-' in part:
+            start, end = (int(x) for x in part.split('-'))
+        else:
+            start = int(part)
+            end = maximum if step > 1 else start
+
+        # 7 is also accepted as sunday in the weekday field
+        is_weekday = maximum == 6
+        upper = 7 if is_weekday else maximum
+        if start < minimum or end > upper or start > end:
+            raise ValueError("Cron field {} is out of range {}-{}".format(field, minimum, upper))
+        values.update(value % 7 if is_weekday else value for value in range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    '''
+    A cron-style schedule with the usual 5 fields: minute hour day month weekday
+    Weekday 0 (or 7) is sunday. As in cron, when both day and weekday are restricted,
+    a time matching either of them would be scheduled.
+
+    e.g. CronSchedule("30 2 * * 1-5") runs at 02:30 from monday to friday
+    '''
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != len(CRON_FIELDS):
+            raise ValueError("A cron expression must have 5 fields: {}".format(expression))
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            ParseCronField(field, minimum, maximum) for field, (_, minimum, maximum) in zip(fields, CRON_FIELDS))
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    def __repr__(self):
+        return "CronSchedule({!r})".format(self.expression)
+
+    def MatchDate(self, date: datetime.date) -> bool:
+        if date.month not in self.months:
+            return False
+        # python weekday: monday is 0, cron weekday: sunday is 0
+        day_match = date.day in self.days
+        weekday_match = (date.weekday() + 1) % 7 in self.weekdays
+        if self._any_day:
+            return weekday_match
+        if self._any_weekday:
+            return day_match
+        return day_match or weekday_match
+
+    def NextAfter(self, after: datetime.datetime) -> datetime.datetime:
+        '''Return the first scheduled time strictly after the given time'''
+        current = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        # a schedule like "0 0 29 2 *" still matches within a few years
+        limit = current + datetime.timedelta(days=366 * 5)
+        while current < limit:
+            if not self.MatchDate(current.date()):
+                current = datetime.datetime.combine(current.date() + datetime.timedelta(days=1), datetime.time())
+                continue
+            if current.hour not in self.hours:
+                current = current.replace(minute=0) + datetime.timedelta(hours=1)
+                continue
+            if current.minute not in self.minutes:
+                current = current + datetime.timedelta(minutes=1)
+                continue
+            return current
+        raise ValueError("No scheduled time is found for {}".format(self.expression))
@@ -0,0 +1,97 @@
+import contextlib
+import os
+import threading
+import time
+from typing import Optional
+
+from pyodbc_sql_function.profiling import StageLabel
+
+
+class JobBudgetExceeded(Exception):
+    '''Raised at the start of a stage when a job has used up its runtime or memory budget'''
+
+
+def CurrentMemoryMB() -> Optional[float]:
+    '''
+    Return the current resident memory of this process in MB, None if it could not be measured.
+    Unlike the peak, it goes down when memory is released, so a single large run would not fail all later runs.
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        # only available on linux, the memory budget would not be enforced elsewhere
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+
+
+class RunContext:
+    '''
+    The state of a single run of a job: timings of its stages and its budgets.
+    A job does not need to know about it, it only calls stage() which finds the context of the current thread.
+
+    Budgets are only checked when a stage starts, a stage that hangs is not stopped by them
+    (a hanging query is stopped by the query deadline of the job, see pyodbc_sql_function.profiling).
+    Memory is the current resident memory of the whole runner process, which includes other jobs running at the same time.
+    '''
+    def __init__(self, max_runtime: Optional[float]=None, max_memory_mb: Optional[float]=None):
+        self.max_runtime = max_runtime
+        self.max_memory_mb = max_memory_mb
+        self.start = time.perf_counter()
+        self.stages = []
+        self.peak_memory_mb = None      # largest memory seen at the stage boundaries of this run
+
+    def SampleMemory(self) -> Optional[float]:
+        memory = CurrentMemoryMB()
+        if memory is not None and (self.peak_memory_mb is None or memory > self.peak_memory_mb):
+            self.peak_memory_mb = memory
+        return memory
+
+    def CheckBudget(self, stage_name: str):
+        elapsed = time.perf_counter() - self.start
+        if self.max_runtime is not None and elapsed > self.max_runtime:
+            raise JobBudgetExceeded("Runtime budget of {}s is exceeded before stage {} ({:.1f}s)".format(
+                self.max_runtime, stage_name, elapsed))
+        memory = self.SampleMemory()
+        if self.max_memory_mb is not None and memory is not None and memory > self.max_memory_mb:
+            raise JobBudgetExceeded("Memory budget of {}MB is exceeded before stage {} ({:.0f}MB)".format(
+                self.max_memory_mb, stage_name, memory))
+
+
+_local = threading.local()
+
+
+def CurrentRun() -> Optional[RunContext]:
+    '''Return the context of the job running in this thread, None if the job is not started by the runner'''
+    return getattr(_local, 'run', None)
+
+
+def SetCurrentRun(run: Optional[RunContext]):
+    _local.run = run
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    '''
+    Time a stage of a job, e.g.
+
+        with stage("extract"):
+            df = GetBuildingHma(...)
+
+    When the job is started by the runner, the budget of the job is checked before the stage starts
+    and the timing is kept in the run history. Otherwise the timing is only printed.
+    Statements profiled by pyodbc_sql_function within the stage are tagged with its name.
+    '''
+    run = CurrentRun()
+    if run is not None:
+        run.CheckBudget(name)
+    start = time.perf_counter()
+    try:
+        with StageLabel(name):
+            yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if run is not None:
+            run.stages.append((name, elapsed))
+            run.SampleMemory()
+        print("Stage {}: {:.2f}s".format(name, elapsed))
@@ -0,0 +1,44 @@
+"""
+A user-defined package to facilitate the import of data from mssql database to python environment
+and the export of data from python enviroment back to mssql database.
+
+Only pyodbc is imported with the package. pandas and sqlalchemy are imported on the first call
+of a function that returns a DataFrame or needs an engine, so short jobs start faster.
+Run "python -m pyodbc_sql_function.benchmark_import" to measure the import time.
+"""
+from .sql_function import (
+    QuoteIdentifier,
+    StartConnection,
+    ExecQuery,
+    FetchQueryResultToDF,
+    GetDataFromSqlToDF,
+    DelTable,
+    DropView,
+    ExecNonQuerySQL,
+    ExecManySQL,
+    GetEngine,
+    InsertDFtoDB,
+)
+from .chunked_load import (
+    LoadVerificationError,
+    HashDataFrame,
+    GetCachedExtract,
+    DiscardLocalState,
+    DiscardLoad,
+    CheckUniqueKeys,
+    VerifyLoad,
+    InsertDFtoDBChunked,
+)
+from .profiling import (
+    QueryDeadlineExceeded,
+    QueryProfiler,
+    ParseStatisticsMessages,
+    ParsePlanHashes,
+    IsProcedureCall,
+    EnableProfiling,
+    Profiling,
+    SetStage,
+    StageLabel,
+    ProfileQuery,
+    QueryDeadline,
+)
@@ -0,0 +1,63 @@
+"""
+Measure the import time of pyodbc_sql_function in fresh interpreters.
+
+Usage (from the root of the repository):
+    python -m pyodbc_sql_function.benchmark_import [--repeat 10]
+
+Each case is run in a new python process, so nothing is cached in sys.modules.
+"eager" imports every dependency at once like the old copies of the module did,
+"lazy" only imports the package, and "first dataframe" also calls a function that needs pandas.
+The "job" cases import the entry point of each job, which is what a job started on its own pays before it runs.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from typing import List, NoReturn, Tuple
+
+# each case prints the time spent in the statements, measured inside the child process,
+# as the last line of its output since the statements may print as well
+TIMER_TEMPLATE = """
+import sys, time
+start = time.perf_counter()
+{statement}
+print(time.perf_counter() - start, 'pandas' in sys.modules, 'sqlalchemy' in sys.modules)
+"""
+
+CASES = (
+    ('eager', "import pyodbc, pandas, sqlalchemy"),
+    ('lazy', "import pyodbc_sql_function"),
+    ('first dataframe', "import pyodbc_sql_function\npyodbc_sql_function.FetchQueryResultToDF([], [])"),
+    ('job HmaHierarchy', "import Maintain_HmaHierarchy.main"),
+    ('job AgentScore', "import RealEstateAgentScore.main"),
+    ('job VideoDesc', "import FixVideoDescription.fix_video_description"),
+)
+
+
+def TimeStatement(statement: str, repeat: int) -> Tuple[List[float], bool, bool]:
+    '''Return the seconds spent in the statement for each run in a new interpreter'''
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = TIMER_TEMPLATE.format(statement=statement)
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], cwd=root, check=True,
+                                capture_output=True, text=True).stdout.splitlines()[-1].split()
+        timings.append(float(output[0]))
+    return timings, output[1] == 'True', output[2] == 'True'
+
+
+def main() -> NoReturn:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=10, help="number of runs of each case")
+    args = parser.parse_args()
+
+    print("{:<16} {:>10} {:>10} {:>8} {:>12}".format("case", "median ms", "min ms", "pandas", "sqlalchemy"))
+    for name, statement in CASES:
+        timings, pandas_loaded, sqlalchemy_loaded = TimeStatement(statement, args.repeat)
+        print("{:<16} {:>10.1f} {:>10.1f} {:>8} {:>12}".format(name, statistics.median(timings) * 1000,
+                                                               min(timings) * 1000, str(pandas_loaded), str(sqlalchemy_loaded)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+from typing import Callable, Dict, NoReturn, Optional, Sequence, TYPE_CHECKING
+
+from .sql_function import GetEngine, QuoteIdentifier
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from sqlalchemy.engine import Engine
+
+# table in the destination db that keeps the last committed chunk of each load
+CHECKPOINT_SCHEMA = 'dbo'
+CHECKPOINT_TABLE = 'LoadCheckpoint'
+
+sql_create_checkpoint = """
+    IF OBJECT_ID(N'{schema}.{table}', N'U') IS NULL
+    CREATE TABLE {schema}.{table}(
+        [LoadName] [nvarchar](255) NOT NULL PRIMARY KEY,
+        [ExtractHash] [char](64) NOT NULL,
+        [ChunkSize] [int] NOT NULL,
+        [LastChunk] [int] NOT NULL,
+        [RowsLoaded] [bigint] NOT NULL,
+        [Completed] [bit] NOT NULL,
+        [UpdatedAt] [datetime2] NOT NULL
+    )
+"""
+
+sql_get_checkpoint = """
+    SELECT ExtractHash, ChunkSize, LastChunk, RowsLoaded, Completed
+    FROM {schema}.{table} WHERE LoadName = ?
+"""
+
+sql_delete_checkpoint = """
+    IF OBJECT_ID(N'{schema}.{table}', N'U') IS NOT NULL
+    DELETE {schema}.{table} WHERE LoadName = ?
+"""
+
+sql_set_checkpoint = """
+    UPDATE {schema}.{table}
+    SET ExtractHash = ?, ChunkSize = ?, LastChunk = ?, RowsLoaded = ?, Completed = ?, UpdatedAt = SYSDATETIME()
+    WHERE LoadName = ?;
+    IF @@ROWCOUNT = 0
+        INSERT INTO {schema}.{table} (LoadName, ExtractHash, ChunkSize, LastChunk, RowsLoaded, Completed, UpdatedAt)
+        VALUES (?, ?, ?, ?, ?, ?, SYSDATETIME());
+"""
+
+
+class LoadVerificationError(Exception):
+    '''Raised when the loaded table does not match the extract'''
+
+
+def NormalizeForHash(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Convert every value to a string without trailing spaces,
+    so that an extract and the same data read back from sql server (e.g. padded CHAR columns) have the same hash.
+    '''
+    df = df.astype(object).where(df.notna(), '')
+    return df.apply(lambda col: col.astype(str).str.rstrip())
+
+
+def HashDataFrame(df: pd.DataFrame) -> str:
+    '''Return a sha256 of the rows of a DataFrame, independent of the row order'''
+    import pandas as pd
+
+    df = NormalizeForHash(df)
+    df = df.sort_values(list(df.columns)) if len(df.columns) > 0 else df
+    row_hash = pd.util.hash_pandas_object(df, index=False).values
+    return hashlib.sha256(row_hash.tobytes()).hexdigest()
+
+
+def _StatePath(state_dir: str, load_name: str, suffix: str) -> str:
+    return os.path.join(state_dir, load_name.replace('/', '_') + suffix)
+
+
+def ReadLocalState(state_dir: str, load_name: str) -> Optional[Dict]:
+    path = _StatePath(state_dir, load_name, '.state.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def WriteLocalState(state_dir: str, load_name: str, state: Dict) -> NoReturn:
+    '''Write the state file by rename, so it is never left half written'''
+    os.makedirs(state_dir, exist_ok=True)
+    path = _StatePath(state_dir, load_name, '.state.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def GetCachedExtract(load_name: str, extract_func: Callable[[], pd.DataFrame], state_dir: str='load_state',
+                     max_age: float=12 * 60 * 60) -> pd.DataFrame:
+    '''
+    Return the extract of an unfinished load saved by an earlier run, so a rerun would not extract again.
+    Else call extract_func and save its result until InsertDFtoDBChunked completes the load.
+    The saved extract is only reused if some of its chunks have been committed, i.e. the earlier run failed
+    half way through the load. If it failed before loading (e.g. on duplicate keys), the data is extracted again.
+    A saved extract older than max_age seconds is discarded, so the next scheduled run would not load stale data.
+    '''
+    import pandas as pd
+
+    path = _StatePath(state_dir, load_name, '.extract.pkl')
+    state = ReadLocalState(state_dir, load_name)
+    if os.path.exists(path) and state is not None and not state['completed'] and state['last_chunk'] >= 0:
+        age = time.time() - os.path.getmtime(path)
+        if age <= max_age:
+            df = pd.read_pickle(path)
+            if HashDataFrame(df) == state['extract_hash']:
+                print("Resume with the extract saved at {}".format(path))
+                return df
+            print("Discard the extract saved at {} (it is not the one being loaded)".format(path))
+        else:
+            print("Discard the extract saved at {} ({:.1f} hours old)".format(path, age / 3600))
+
+    df = extract_func()
+    os.makedirs(state_dir, exist_ok=True)
+    df.to_pickle(path + '.tmp')
+    os.replace(path + '.tmp', path)
+    WriteLocalState(state_dir, load_name, {'extract_hash': None, 'chunk_size': None, 'last_chunk': -1,
+                                           'rows_loaded': 0, 'completed': False})
+    return df
+
+
+def _ReadCheckpoint(engine: Engine, load_name: str) -> Optional[Dict]:
+    schema, table = QuoteIdentifier(CHECKPOINT_SCHEMA), QuoteIdentifier(CHECKPOINT_TABLE)
+    with engine.begin() as con:
+        con.exec_driver_sql(sql_create_checkpoint.format(schema=schema, table=table))
+        row = con.exec_driver_sql(sql_get_checkpoint.format(schema=schema, table=table), (load_name,)).fetchone()
+    if row is None:
+        return None
+    return {'extract_hash': row[0].strip(), 'chunk_size': row[1], 'last_chunk': row[2],
+            'rows_loaded': row[3], 'completed': bool(row[4])}
+
+
+def DiscardLocalState(load_name: str, state_dir: str='load_state') -> NoReturn:
+    '''Remove the local state and the saved extract of a load, so the next run extracts again'''
+    for suffix in ('.state.json', '.extract.pkl'):
+        path = _StatePath(state_dir, load_name, suffix)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _CompleteLocalState(load_name: str, state_dir: str, state: Dict) -> NoReturn:
+    '''Mark the load completed in the local state and remove its saved extract'''
+    state = dict(state, completed=True)
+    WriteLocalState(state_dir, load_name, state)
+    extract_path = _StatePath(state_dir, load_name, '.extract.pkl')
+    if os.path.exists(extract_path):
+        os.remove(extract_path)
+
+
+def DiscardLoad(engine: Engine, load_name: str, state_dir: str='load_state') -> NoReturn:
+    '''Remove the checkpoint, the local state and the saved extract of a load, so the next run starts over'''
+    schema, table = QuoteIdentifier(CHECKPOINT_SCHEMA), QuoteIdentifier(CHECKPOINT_TABLE)
+    with engine.begin() as con:
+        con.exec_driver_sql(sql_delete_checkpoint.format(schema=schema, table=table), (load_name,))
+    DiscardLocalState(load_name, state_dir)
+    print("Checkpoint of {} is discarded".format(load_name))
+
+
+def CheckUniqueKeys(dataframe: pd.DataFrame, key_columns: Sequence[str], load_name: Optional[str]=None,
+                    state_dir: str='load_state') -> NoReturn:
+    '''
+    Raise ValueError if key_columns do not identify a single row,
+    because a chunk is deleted by key when a load resumes and would also delete rows of the chunk before it.
+    If load_name is given, the saved extract of the load is discarded before raising,
+    so a rerun after the source is fixed would extract again.
+    '''
+    duplicated = dataframe.duplicated(list(key_columns), keep=False)
+    if duplicated.any():
+        if load_name is not None:
+            DiscardLocalState(load_name, state_dir)
+        sample = dataframe.loc[duplicated, list(key_columns)].drop_duplicates().head(5).values.tolist()
+        raise ValueError("{} rows have duplicate keys on {}, e.g. {}".format(int(duplicated.sum()), list(key_columns), sample))
+
+
+def _WriteCheckpoint(con, load_name: str, state: Dict) -> NoReturn:
+    schema, table = QuoteIdentifier(CHECKPOINT_SCHEMA), QuoteIdentifier(CHECKPOINT_TABLE)
+    values = (state['extract_hash'], state['chunk_size'], state['last_chunk'], state['rows_loaded'], state['completed'])
+    con.exec_driver_sql(sql_set_checkpoint.format(schema=schema, table=table), values + (load_name, load_name) + values)
+
+
+def VerifyLoad(engine: Engine, table: str, schema: str, dataframe: pd.DataFrame) -> NoReturn:
+    '''Compare the row count and the hash of the loaded table with the extract'''
+    import pandas as pd
+
+    columns = ", ".join(QuoteIdentifier(col) for col in dataframe.columns)
+    loaded = pd.read_sql_query("SELECT {} FROM {}.{}".format(columns, QuoteIdentifier(schema), QuoteIdentifier(table)), engine)
+    if len(loaded) != len(dataframe):
+        raise LoadVerificationError("{}.{} has {} rows but the extract has {} rows".format(schema, table, len(loaded), len(dataframe)))
+    if HashDataFrame(loaded) != HashDataFrame(dataframe):
+        raise LoadVerificationError("Data in {}.{} does not match the extract".format(schema, table))
+    print("Verified {} rows in {}.{}".format(len(loaded), schema, table))
+
+
+def InsertDFtoDBChunked(table: str, schema: str, dataframe: pd.DataFrame, key_columns: Sequence[str], dtype=None,
+                        con: Dict[str, str]=None, engine: Engine=None, chunk_size: int=5000,
+                        state_dir: str='load_state', load_name: str=None, verify: bool=True) -> int:
+    """
+    A resumable replacement of the delete-then-append pattern of DelTable and InsertDFtoDB.
+
+    Rows are sorted by key_columns and appended in chunks, each chunk committed in its own transaction
+    together with a checkpoint in dbo.LoadCheckpoint. The checkpoint is also kept in a local state file.
+    If the extract is the same as the one of an unfinished load, the load resumes after the last committed chunk.
+    Rows of the first resumed chunk are deleted by key before insertion, so a chunk could be loaded twice safely.
+    Otherwise the table is emptied and loaded from the first chunk.
+
+    Row count and hash of the table are compared with the extract at the end if verify is True.
+    If they do not match, the checkpoint and the saved extract are discarded before LoadVerificationError is raised,
+    so the next run extracts and loads again from the first chunk.
+    key_columns must identify a single row, else ValueError is raised before anything is loaded.
+    The number of rows inserted by this call would be returned.
+    """
+    if engine is None:
+        if con is None:
+            raise TypeError('Either con or engine must be provided')
+        engine = GetEngine(con)
+    if load_name is None:
+        load_name = "{}.{}".format(schema, table)
+
+    key_columns = list(key_columns)
+    CheckUniqueKeys(dataframe, key_columns, load_name, state_dir)
+    dataframe = dataframe.sort_values(key_columns, kind='mergesort').reset_index(drop=True)
+    extract_hash = HashDataFrame(dataframe)
+    chunk_count = (len(dataframe) + chunk_size - 1) // chunk_size
+
+    # the checkpoint in destination is committed together with the data, the local one is used if it is not available
+    checkpoint = _ReadCheckpoint(engine, load_name)
+    if checkpoint is None:
+        checkpoint = ReadLocalState(state_dir, load_name)
+    resume = (checkpoint is not None and checkpoint['extract_hash'] == extract_hash
+              and checkpoint['chunk_size'] == chunk_size)
+
+    if resume and checkpoint['completed']:
+        print("{} has already been loaded with the same extract.".format(load_name))
+        _CompleteLocalState(load_name, state_dir, checkpoint)
+        return 0
+
+    quoted_table = "{}.{}".format(QuoteIdentifier(schema), QuoteIdentifier(table))
+    if resume:
+        state = checkpoint
+        print("Resume loading {} from chunk {} of {}".format(load_name, state['last_chunk'] + 1, chunk_count))
+    else:
+        state = {'extract_hash': extract_hash, 'chunk_size': chunk_size, 'last_chunk': -1, 'rows_loaded': 0, 'completed': False}
+        with engine.begin() as con:
+            con.exec_driver_sql("IF OBJECT_ID(N'{0}', N'U') IS NOT NULL DELETE {0}".format(quoted_table))
+            _WriteCheckpoint(con, load_name, state)
+        WriteLocalState(state_dir, load_name, state)
+        print("Start loading {} in {} chunks".format(load_name, chunk_count))
+
+    sql_delete_key = "DELETE {} WHERE {}".format(quoted_table, " AND ".join(QuoteIdentifier(col) + " = ?" for col in key_columns))
+    inserted = 0
+    for chunk_no in range(state['last_chunk'] + 1, chunk_count):
+        chunk = dataframe.iloc[chunk_no * chunk_size:(chunk_no + 1) * chunk_size]
+        with engine.begin() as con:
+            if resume and chunk_no == checkpoint['last_chunk'] + 1:
+                con.exec_driver_sql(sql_delete_key, [tuple(row) for row in chunk[key_columns].astype(object).values.tolist()])
+            chunk.to_sql(name=table, con=con, if_exists='append', index=False, schema=schema, dtype=dtype)
+            state['last_chunk'] = chunk_no
+            state['rows_loaded'] = chunk_no * chunk_size + len(chunk)
+            _WriteCheckpoint(con, load_name, state)
+        WriteLocalState(state_dir, load_name, state)
+        inserted += len(chunk)
+        print("Chunk {} of {} is committed ({} rows)".format(chunk_no + 1, chunk_count, state['rows_loaded']))
+
+    if verify:
+        try:
+            VerifyLoad(engine, table, schema, dataframe)
+        except LoadVerificationError:
+            DiscardLoad(engine, load_name, state_dir)
+            raise
+
+    state['completed'] = True
+    with engine.begin() as con:
+        _WriteCheckpoint(con, load_name, state)
+    _CompleteLocalState(load_name, state_dir, state)
+    print("Finish Insertion")
+    return inserted
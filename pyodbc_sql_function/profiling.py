@@ -0,0 +1,388 @@
+"""
+An opt-in profiling mode for the functions in pyodbc_sql_function.
+
+When a QueryProfiler is enabled in a thread, every statement executed by ExecQuery, GetDataFromSqlToDF,
+DelTable, DropView, ExecNonQuerySQL and ExecManySQL in that thread is run with SET STATISTICS IO, TIME ON
+(and SET STATISTICS XML ON if the actual plan is wanted). The informational messages returned by sql server are
+parsed into logical reads, physical reads and cpu time, tagged by job and stage, and appended to a history file.
+A plan hash different from the last run of the same statement is flagged.
+
+A deadline could be given to every query: the query is cancelled when it runs longer,
+and QueryDeadlineExceeded is raised instead of holding the whole job window.
+With a deadline only (capture_stats and capture_plan False), no statistics are requested and nothing is recorded.
+
+Usage:
+    with Profiling(job='HmaHierarchy', capture_plan=True, deadline=600):
+        with StageLabel('validate'):
+            ExecQuery(...)
+
+Only the cursor interface (execute, nextset, messages, description, fetchall, cancel) is used,
+so a recorded or mocked message stream could be replayed through QueryProfile.
+"""
+import contextlib
+import datetime
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Iterable, List, NoReturn, Optional, Sequence, Tuple, Union
+
+# column name of the result set returned by SET STATISTICS XML ON
+SHOWPLAN_COLUMN = 'Microsoft SQL Server 2005 XML Showplan'
+
+# sqlstate of a query stopped by the query timeout or by cancel
+DEADLINE_SQLSTATES = ('HYT00', 'HY008')
+
+re_table_io = re.compile(r"Table '(?P<table>[^']+)'\. Scan count (?P<scan_count>\d+), logical reads (?P<logical_reads>\d+), "
+                         r"physical reads (?P<physical_reads>\d+)(?:.*?read-ahead reads (?P<read_ahead_reads>\d+))?")
+re_compile_time = re.compile(r"parse and compile time:\s*CPU time = (?P<cpu>\d+) ms, elapsed time = (?P<elapsed>\d+) ms")
+re_execution_time = re.compile(r"Execution Times:\s*CPU time = (?P<cpu>\d+) ms,\s*elapsed time = (?P<elapsed>\d+) ms")
+re_plan_hash = re.compile(r'QueryPlanHash="(?P<hash>0x[0-9A-Fa-f]+)"')
+re_procedure_call = re.compile(r"^\s*(?:\{\s*call\b|exec(?:ute)?\b)", re.IGNORECASE)
+
+
+class QueryDeadlineExceeded(Exception):
+    """Raised when a query is cancelled because it runs longer than its deadline"""
+
+
+def _MessageText(message: Union[str, Tuple[str, str]]) -> str:
+    # pyodbc returns each message as a tuple of (sqlstate, text)
+    if isinstance(message, (tuple, list)):
+        return str(message[-1])
+    return str(message)
+
+
+def IsProcedureCall(sql_string: str) -> bool:
+    """Return True if the sql string executes a stored procedure, e.g. execute dbo.ExportCentaScoreData"""
+    return re_procedure_call.match(sql_string) is not None
+
+
+def ParseStatisticsMessages(messages: Iterable[Union[str, Tuple[str, str]]], procedure: bool=False) -> Dict[str, Any]:
+    """
+    Return the totals of the STATISTICS IO and STATISTICS TIME messages of a statement,
+    together with the reads of each table.
+
+    STATISTICS TIME sends a message for every statement executed. For a procedure call, every statement inside
+    the procedure has its own message and the EXEC sends a last one with the total of the whole call,
+    so only the last message is counted if procedure is True. Messages of a batch of statements are summed.
+    """
+    stats = {'logical_reads': 0, 'physical_reads': 0, 'read_ahead_reads': 0, 'scan_count': 0,
+             'compile_cpu_ms': 0, 'compile_elapsed_ms': 0, 'cpu_ms': 0, 'elapsed_ms': 0, 'time_messages': 0, 'tables': {}}
+    execution_times = []
+    for message in messages:
+        text = _MessageText(message)
+        for match in re_table_io.finditer(text):
+            table = stats['tables'].setdefault(match.group('table'), {'scan_count': 0, 'logical_reads': 0, 'physical_reads': 0, 'read_ahead_reads': 0})
+            for key in ('scan_count', 'logical_reads', 'physical_reads', 'read_ahead_reads'):
+                value = int(match.group(key) or 0)
+                table[key] += value
+                stats[key] += value
+        for match in re_compile_time.finditer(text):
+            stats['compile_cpu_ms'] += int(match.group('cpu'))
+            stats['compile_elapsed_ms'] += int(match.group('elapsed'))
+        for match in re_execution_time.finditer(text):
+            execution_times.append((int(match.group('cpu')), int(match.group('elapsed'))))
+
+    stats['time_messages'] = len(execution_times)
+    if procedure and execution_times:
+        stats['cpu_ms'], stats['elapsed_ms'] = execution_times[-1]
+    else:
+        stats['cpu_ms'] = sum(cpu for cpu, _ in execution_times)
+        stats['elapsed_ms'] = sum(elapsed for _, elapsed in execution_times)
+    return stats
+
+
+def ParsePlanHashes(plans: Iterable[str]) -> List[str]:
+    """Return the QueryPlanHash of every statement in the showplan xml documents"""
+    hashes = []
+    for plan in plans:
+        hashes.extend(match.group('hash') for match in re_plan_hash.finditer(plan))
+    return hashes
+
+
+def IsPlanResult(description: Optional[Sequence[Sequence[Any]]]) -> bool:
+    """Return True if the current result set is the actual plan returned by SET STATISTICS XML ON"""
+    return description is not None and len(description) == 1 and description[0][0] == SHOWPLAN_COLUMN
+
+
+def StatementHash(sql_string: str) -> str:
+    """Identify a statement by its text, ignoring differences in white spaces and letter cases"""
+    return hashlib.sha1(" ".join(sql_string.split()).lower().encode('utf-8')).hexdigest()[:16]
+
+
+class QueryProfiler:
+    """
+    Settings and history of the profiling mode of a job.
+    history_path: file that records of all statements are appended to, and plan hashes of earlier runs are read from
+    capture_stats: capture STATISTICS IO / TIME
+    capture_plan: capture the actual plan, needed to detect plan changes. Plans are saved in plan_dir if given
+    deadline: seconds a single query could run before it is cancelled, stage_deadlines overrides it for some stages
+    If neither stats nor plan is captured, only the deadline is enforced and no record is written.
+    """
+    def __init__(self, job: str, history_path: str='query_profile.jsonl', capture_stats: bool=True,
+                 capture_plan: bool=False, plan_dir: Optional[str]=None, deadline: Optional[float]=None,
+                 stage_deadlines: Optional[Dict[str, float]]=None):
+        self.job = job
+        self.history_path = history_path
+        self.capture_stats = capture_stats
+        self.capture_plan = capture_plan
+        self.plan_dir = plan_dir
+        self.deadline = deadline
+        self.stage_deadlines = stage_deadlines or {}
+        self.stage = None
+        self.records = []
+        self._lock = threading.Lock()
+        self.last_plan_hashes = self._LoadPlanHashes() if capture_plan else {}
+
+    def Capturing(self) -> bool:
+        """Return True if statements are profiled, False if only the deadline is enforced"""
+        return self.capture_stats or self.capture_plan
+
+    def _LoadPlanHashes(self) -> Dict[Tuple[str, str], List[str]]:
+        """Return the plan hashes of the last run of each statement of this job"""
+        plan_hashes = {}
+        if self.history_path is None or not os.path.exists(self.history_path):
+            return plan_hashes
+        with open(self.history_path, encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                if record['job'] == self.job and record.get('plan_hashes'):
+                    plan_hashes[(record['stage'], record['statement_hash'])] = record['plan_hashes']
+        return plan_hashes
+
+    def DeadlineOf(self, stage: Optional[str]) -> Optional[float]:
+        return self.stage_deadlines.get(stage, self.deadline)
+
+    def Record(self, record: Dict[str, Any], plans: List[str]) -> NoReturn:
+        key = (record['stage'], record['statement_hash'])
+        if record['plan_hashes']:
+            last = self.last_plan_hashes.get(key)
+            record['plan_changed'] = last is not None and last != record['plan_hashes']
+            if record['plan_changed']:
+                print("Plan of statement {} in stage {} has changed: {} -> {}".format(
+                    record['statement_hash'], record['stage'], last, record['plan_hashes']))
+            self.last_plan_hashes[key] = record['plan_hashes']
+
+        if plans and self.plan_dir is not None:
+            os.makedirs(self.plan_dir, exist_ok=True)
+            file_name = "{}_{}_{}_{}.sqlplan".format(self.job, record['stage'], record['statement_hash'],
+                                                    datetime.datetime.now().strftime('%Y%m%d%H%M%S%f'))
+            with open(os.path.join(self.plan_dir, file_name), 'w', encoding='utf-8') as f:
+                f.write("\n".join(plans))
+            record['plan_file'] = file_name
+
+        with self._lock:
+            self.records.append(record)
+            if self.history_path is not None:
+                with open(self.history_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        print("Profile: {elapsed_ms} ms elapsed, {cpu_ms} ms cpu, {logical_reads} logical reads".format(**record))
+
+
+class QueryProfile:
+    """
+    Profile of a single statement. Messages and plans of every result set are collected by Collect,
+    the remaining result sets are drained and the record is written when the profile is closed.
+    """
+    def __init__(self, profiler: QueryProfiler, cursor, sql_string: str):
+        self.profiler = profiler
+        self.cursor = cursor
+        self.sql_string = sql_string
+        self.stage = profiler.stage
+        self.messages = []
+        self.plans = []
+        self.cancelled = False
+        self._collected = None
+        self._timer = None
+        self._old_timeout = None
+
+    def Start(self) -> NoReturn:
+        if self.profiler.Capturing():
+            # the settings stay on the connection, a separate cursor is used so the prepared statement is kept
+            settings = "SET STATISTICS IO ON; SET STATISTICS TIME ON;"
+            settings += " SET STATISTICS XML ON;" if self.profiler.capture_plan else " SET STATISTICS XML OFF;"
+            settings_cursor = self.cursor.connection.cursor()
+            settings_cursor.execute(settings)
+            settings_cursor.close()
+
+        deadline = self.profiler.DeadlineOf(self.stage)
+        if deadline is not None:
+            # query timeout of the driver stops the query on the server,
+            # cancel from a timer also stops a query that the driver does not time out, e.g. while fetching
+            connection = getattr(self.cursor, 'connection', None)
+            if connection is not None:
+                self._old_timeout = connection.timeout
+                connection.timeout = max(1, int(deadline))
+            self._timer = threading.Timer(deadline, self._Cancel)
+            self._timer.daemon = True
+            self._timer.start()
+        self.started = time.perf_counter()
+        self.started_at = datetime.datetime.now().isoformat()
+
+    def _Cancel(self) -> NoReturn:
+        self.cancelled = True
+        print("Deadline of {}s is reached, cancelling: {}".format(self.profiler.DeadlineOf(self.stage), self.sql_string[:200]))
+        self.cursor.cancel()
+
+    def Collect(self, cursor=None) -> NoReturn:
+        """Keep the messages of the current result set, and the plan if it is a plan result set"""
+        cursor = cursor or self.cursor
+        # pyodbc makes a new list of messages for every result set, so the same list is not collected twice
+        messages = getattr(cursor, 'messages', None)
+        if messages is not None and messages is not self._collected:
+            self.messages.extend(messages)
+            self._collected = messages
+        if IsPlanResult(cursor.description):
+            self.plans.extend(row[0] for row in cursor.fetchall())
+
+    def Drain(self) -> NoReturn:
+        """Read the messages and plans of the remaining result sets"""
+        self.Collect()
+        while self.cursor.nextset():
+            self.Collect()
+
+    def Close(self, error: Optional[BaseException]=None) -> NoReturn:
+        if self._timer is not None:
+            self._timer.cancel()
+        if self._old_timeout is not None:
+            self.cursor.connection.timeout = self._old_timeout
+        if not self.profiler.Capturing():
+            return
+
+        stats = ParseStatisticsMessages(self.messages, IsProcedureCall(self.sql_string))
+        record = {'job': self.profiler.job,
+                  'stage': self.stage,
+                  'statement_hash': StatementHash(self.sql_string),
+                  'statement': " ".join(self.sql_string.split())[:500],
+                  'started': self.started_at,
+                  'client_seconds': round(time.perf_counter() - self.started, 3),
+                  'status': 'success' if error is None else ('deadline_exceeded' if self.IsDeadlineError(error) else 'failed'),
+                  'plan_hashes': ParsePlanHashes(self.plans),
+                  'plan_changed': False}
+        record.update(stats)
+        self.profiler.Record(record, self.plans)
+
+    def IsDeadlineError(self, error: BaseException) -> bool:
+        return self.cancelled or IsTimeoutError(error)
+
+
+def IsTimeoutError(error: Optional[BaseException]) -> bool:
+    """Return True if the error, or the error it is raised from (e.g. by pandas), is a query timeout or cancel"""
+    while error is not None:
+        sqlstate = error.args[0] if error.args else None
+        if isinstance(sqlstate, str) and sqlstate in DEADLINE_SQLSTATES:
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class _NoProfile:
+    """Used when profiling is not enabled, so callers do not need to check"""
+    def Collect(self, cursor=None) -> NoReturn:
+        pass
+
+    def Drain(self) -> NoReturn:
+        pass
+
+
+_local = threading.local()
+
+
+def ActiveProfiler() -> Optional[QueryProfiler]:
+    return getattr(_local, 'profiler', None)
+
+
+def EnableProfiling(profiler: Optional[QueryProfiler]) -> Optional[QueryProfiler]:
+    """Enable a profiler in the current thread, None to disable. The previous profiler would be returned"""
+    previous = ActiveProfiler()
+    _local.profiler = profiler
+    return previous
+
+
+@contextlib.contextmanager
+def Profiling(job: str, **kwargs):
+    """Enable a QueryProfiler in the current thread within the block, see QueryProfiler for the arguments"""
+    profiler = QueryProfiler(job, **kwargs)
+    previous = EnableProfiling(profiler)
+    try:
+        yield profiler
+    finally:
+        EnableProfiling(previous)
+
+
+def SetStage(stage: Optional[str]) -> Optional[str]:
+    """Tag the following statements of the active profiler with a stage, the previous stage would be returned"""
+    profiler = ActiveProfiler()
+    if profiler is None:
+        return None
+    previous = profiler.stage
+    profiler.stage = stage
+    return previous
+
+
+@contextlib.contextmanager
+def StageLabel(stage: str):
+    previous = SetStage(stage)
+    try:
+        yield
+    finally:
+        SetStage(previous)
+
+
+@contextlib.contextmanager
+def ProfileQuery(cursor, sql_string: str):
+    """
+    Profile a statement executed on the cursor within the block, e.g.
+
+        with ProfileQuery(cursor, sql_string) as query:
+            cursor.execute(sql_string)
+            data = cursor.fetchall()
+            query.Drain()
+
+    Result sets left unread are drained when the block ends.
+    QueryDeadlineExceeded is raised if the statement is cancelled by its deadline.
+    """
+    profiler = ActiveProfiler()
+    if profiler is None:
+        yield _NoProfile()
+        return
+
+    query = QueryProfile(profiler, cursor, sql_string)
+    query.Start()
+    try:
+        yield query
+        if profiler.Capturing():
+            query.Drain()
+    except Exception as e:
+        query.Close(e)
+        if query.IsDeadlineError(e):
+            raise QueryDeadlineExceeded("Query is cancelled after {}s: {}".format(profiler.DeadlineOf(query.stage), sql_string[:200])) from e
+        raise
+    query.Close()
+
+
+@contextlib.contextmanager
+def QueryDeadline(connection, sql_string: str):
+    """
+    Enforce the deadline of the active profiler by the query timeout of the connection only,
+    for statements run on cursors that are not accessible, e.g. by pandas.read_sql_query.
+    QueryDeadlineExceeded is raised if the statement times out.
+    """
+    profiler = ActiveProfiler()
+    deadline = profiler.DeadlineOf(profiler.stage) if profiler is not None else None
+    if deadline is None:
+        yield
+        return
+
+    old_timeout = connection.timeout
+    connection.timeout = max(1, int(deadline))
+    try:
+        yield
+    except Exception as e:
+        if IsTimeoutError(e):
+            raise QueryDeadlineExceeded("Query times out after {}s: {}".format(deadline, sql_string[:200])) from e
+        raise
+    finally:
+        connection.timeout = old_timeout
@@ -0,0 +1,316 @@
+from __future__ import annotations
+
+from typing import Union, Dict, List, NoReturn, Tuple, Optional, Sequence, Iterable, Any, TYPE_CHECKING
+import pyodbc
+
+from .profiling import ProfileQuery, QueryDeadline, IsPlanResult, ActiveProfiler
+
+# pandas and sqlalchemy take most of the import time of this module,
+# so they are imported inside the functions that use them instead of at module load.
+if TYPE_CHECKING:
+    import pandas as pd
+    from sqlalchemy.engine import Engine
+
+# connect url used by sqlalchemy engine
+CON_URL = "mssql+pyodbc://{user}:{pw}@{server}/{db}?driver={driver}"
+
+
+def QuoteIdentifier(name: str) -> str:
+    """
+    Return a safely quoted sql server identifier, e.g. schema name or table name.
+    A multi-part name like "dbo.video" would be quoted part by part.
+    """
+    return ".".join("[" + part.replace("]", "]]") + "]" for part in name.split("."))
+
+
+def StartConnection(driver: str, server: str, db: str, user: str=None, pw: str=None, win_auth: bool=False) -> pyodbc.Connection:
+    """
+    A function that returns a pyodbc connection object
+    """
+    if win_auth:
+        connect_str = "DRIVER={{{driver}}};SERVER={server};DATABASE={db};Trusted_Connection=yes;"
+        connect_str = connect_str.format(driver=driver,
+                                         server=server,
+                                         db=db)
+    else:
+        connect_str = "DRIVER={{{driver}}};SERVER={server};DATABASE={db};UID={user};PWD={pw}"
+        connect_str = connect_str.format(driver=driver,
+                                         server=server,
+                                         db=db,
+                                         user=user,
+                                         pw=pw)
+
+    connection = pyodbc.connect(connect_str)
+    print("Finish Connecting to {ip} @ {db}\n".format(ip=server, db=db))
+    return connection
+
+
+def ExecQuery(con: Union[Dict[str, str], pyodbc.Connection], sql_string: str, nextset: bool=False, win_auth: bool=False, params: Optional[Sequence[Any]]=None):
+    """
+    Given a connection dict or connection and sql string
+    Excute query sql statement, return the fetched data set and a list of column name
+    Values could be bound to "?" in the sql string by params.
+    """
+    if type(con) == dict:
+        con = StartConnection(**con, win_auth=win_auth)
+
+    cursor = con.cursor()
+    print("Executing SQL statement: {}".format(sql_string))
+    with ProfileQuery(cursor, sql_string) as query:
+        if params is None:
+            cursor.execute(sql_string)
+        else:
+            cursor.execute(sql_string, params)
+
+        data = ""
+        col_name_list = []
+        if not nextset:
+            # plans are only returned in profiling mode
+            while IsPlanResult(cursor.description):
+                query.Collect()
+                cursor.nextset()
+            data = cursor.fetchall()
+            col_name_list = list(col[0] for col in cursor.description)
+        else:
+            while True:
+                query.Collect()
+                if not cursor.nextset():
+                    break
+                if IsPlanResult(cursor.description):
+                    continue
+                try:
+                    data = cursor.fetchall()
+                    col_name_list = list(col[0] for col in cursor.description)
+                    break
+                except pyodbc.ProgrammingError:
+                    continue
+    cursor.close()
+    del cursor
+    con.close()
+
+    print("Finish Execution")
+    print("{} records are found.".format(len(data)))
+    msg = "Fields of data: \n"
+    for field in enumerate(col_name_list):
+        msg = msg + str(field[0]) + ": " + str(field[1]) + "\n"
+    print(msg, "\n")
+    return data, col_name_list
+
+
+def FetchQueryResultToDF(data, col_name: List[str]) -> pd.DataFrame:
+    """
+    A function that can convert query result from pyodbc into pandas dataframe.
+    A pandas dataframe and a list of column name would be returned
+    """
+    import pandas as pd
+
+    result = []
+    for row in data:
+        to_be_append = []
+        for col in row:
+            to_be_append.append(col)
+        result.append(to_be_append)
+    df = pd.DataFrame(result, columns=col_name)
+    print(df)
+    return df
+
+
+def GetDataFromSqlToDF(con: Union[Dict[str, str], pyodbc.Connection], sql_string: str, win_auth: bool=False, params: Optional[Sequence[Any]]=None) -> pd.DataFrame:
+    """
+    A function that retrieve data from sql server db to a pandas dataframe.
+    Default function in pandas would be used for simply query.
+    For complex query, mannual fetching would be used.
+    Values could be bound to "?" in the sql string by params.
+    A pandas dataframe and a list of column name would be returned.
+    """
+    import pandas as pd
+
+    if type(con) == dict:
+        con = StartConnection(con['driver'], con['server'], con['db'], con['user'], con['pw'], win_auth)
+
+    profiler = ActiveProfiler()
+    if profiler is not None and profiler.Capturing():
+        # pandas reads the cursor by itself, so data is fetched manually to keep the messages for profiling
+        try:
+            data, col = ExecQuery(con, sql_string, False, params=params)
+        except pyodbc.ProgrammingError:
+            data, col = ExecQuery(con, sql_string, True, params=params)
+        return FetchQueryResultToDF(data, col)
+
+    try:
+        with QueryDeadline(con, sql_string):
+            df = pd.read_sql_query(sql_string, con, params=params)
+        col_name_list = list(df.columns)
+        
+        print("Finish Execution")
+        print("{} records are found.".format(len(df)))
+        msg = "Fields of data: \n"
+        for field in enumerate(col_name_list):
+            msg = msg + str(field[0]) + ": " + str(field[1]) + "\n"
+        print(msg, "\n")
+
+        con.close()
+        return df
+
+    except pyodbc.ProgrammingError:
+        data, col = ExecQuery(con, sql_string, True, params=params)
+        df = FetchQueryResultToDF(data, col)
+        return df
+
+
+def DelTable(con_obj: Union[Dict[str, str], pyodbc.Connection], table: str, schema: str, return_con: bool=False, win_auth: bool=False) -> Optional[pyodbc.Connection]:
+    """
+    Given a connection object, table name, schema: either a dictionary or a connection,
+    this function delete all records in the table.
+
+    An opened connection would be returned and transaction would not be committed if specified.
+    Else transaction would be committed and connection would be closed.
+    """
+    if type(con_obj) == dict:
+        con_obj = StartConnection(**con_obj, win_auth=win_auth)
+        
+    cursor = con_obj.cursor()
+    sql_string = "delete {schema}.{table}".format(schema=QuoteIdentifier(schema), table=QuoteIdentifier(table))
+
+    try:
+        with ProfileQuery(cursor, sql_string):
+            cursor.execute(sql_string)
+        con_obj.commit()
+    except pyodbc.ProgrammingError as e:
+        if str(e)[172:176] == '3701':
+            print("Table {schema}.{table} is not found.".format(schema=schema, table=table))
+            pass
+        else:
+            raise
+
+    if return_con:
+        return con_obj
+    else:
+        con_obj.close()
+
+
+def DropView(con_obj: Union[Dict[str, str], pyodbc.Connection], view: str, schema: str, return_con: bool=False, win_auth: bool=False) -> Optional[pyodbc.Connection]:
+    """
+    Given a connection object, view, schema: either a dictionary or a connection,
+    this function delete all records in the table.
+
+    An opened connection would be returned and transaction would not be committed if specified.
+    Else transaction would be committed and connection would be closed.
+    """
+    if type(con_obj) == dict:
+        con_obj = StartConnection(**con_obj, win_auth=win_auth)
+        
+    cursor = con_obj.cursor()
+    sql_string = "drop view {schema}.{view}".format(schema=QuoteIdentifier(schema), view=QuoteIdentifier(view))
+
+    try:
+        with ProfileQuery(cursor, sql_string):
+            cursor.execute(sql_string)
+        con_obj.commit()
+    except pyodbc.ProgrammingError as e:
+        if str(e)[172:176] == '3701':
+            print("View {schema}.{view} is not found.".format(schema=schema, view=view))
+            pass
+        else:
+            raise
+
+    if return_con:
+        return con_obj
+    else:
+        con_obj.close()
+
+
+def ExecNonQuerySQL(con_obj: Union[Dict[str, str], pyodbc.Connection], sql_string: str, return_con: bool=False, params: Optional[Sequence[Any]]=None) -> Optional[pyodbc.Connection]:
+    """
+    A function that used to execute sql statement that would not return any result-set.
+    Values could be bound to "?" in the sql string by params.
+    If specified, an opened connection would be return for reuse,
+    else transaction would be commit and the connection would be closed
+    """
+    if type(con_obj) == dict:
+        con_obj = StartConnection(**con_obj, win_auth=False)
+
+    cursor = con_obj.cursor()
+    with ProfileQuery(cursor, sql_string):
+        if params is None:
+            cursor.execute(sql_string)
+        else:
+            cursor.execute(sql_string, params)
+    cursor.close()
+    con_obj.commit()
+    
+    if return_con:
+        return con_obj
+    else:
+        con_obj.close()
+
+
+def ExecManySQL(con_obj: Union[Dict[str, str], pyodbc.Connection], sql_string: str, param_list: Iterable[Sequence[Any]], return_con: bool=False, batch_size: int=1000, win_auth: bool=False) -> Optional[pyodbc.Connection]:
+    """
+    A function that execute a parameterized sql statement once for each set of values in param_list.
+    The statement is prepared once for the cursor and the values are sent to the server in batches of batch_size.
+    Transaction would be committed after all batches are executed.
+    If specified, an opened connection would be return for reuse,
+    else the connection would be closed
+    """
+    if type(con_obj) == dict:
+        con_obj = StartConnection(**con_obj, win_auth=win_auth)
+
+    cursor = con_obj.cursor()
+    cursor.fast_executemany = True
+
+    print("Executing SQL statement in batch: {}".format(sql_string))
+    row_count = 0
+    batch = []
+    for params in param_list:
+        batch.append(params)
+        if len(batch) == batch_size:
+            with ProfileQuery(cursor, sql_string):
+                cursor.executemany(sql_string, batch)
+            row_count += len(batch)
+            batch = []
+    if batch:
+        with ProfileQuery(cursor, sql_string):
+            cursor.executemany(sql_string, batch)
+        row_count += len(batch)
+    cursor.close()
+    con_obj.commit()
+    print("{} sets of parameters are executed.".format(row_count))
+
+    if return_con:
+        return con_obj
+    else:
+        con_obj.close()
+
+
+# sqlalchemy engines created by GetEngine, keyed by connect url
+_engine_cache = {}
+
+
+def GetEngine(con_dict: Dict[str, str]) -> Engine:
+    """
+    Return a sqlalchemy engine for a connection dict.
+    Engines are cached by connect url, so the connection pool of an engine is shared by all callers.
+    """
+    con_url = CON_URL.format(user=con_dict['user'], pw=con_dict['pw'], server=con_dict['server'], db=con_dict['db'],
+                             driver=con_dict['driver'].replace(' ', '+'))
+    if con_url not in _engine_cache:
+        from sqlalchemy import create_engine
+        _engine_cache[con_url] = create_engine(con_url)
+    return _engine_cache[con_url]
+
+
+def InsertDFtoDB(table: str, schema: str, dataframe: pd.DataFrame, dtype=None, con: Dict[str, str]=None, engine: Engine=None):
+    """
+    A function that would append record to an existing table in sql server.
+    An sql-alchemy engine or a connection dict could be provided for connection
+    """
+    if engine is None:
+        if con is None:
+            raise TypeError('Either con or engine must be provided')
+        else:
+            engine = GetEngine(con)
+
+    print("Start Insertion")
+    dataframe.to_sql(name=table, con=engine, if_exists='append', index=False, schema=schema, dtype=dtype)
+    print("Finish Insertion")
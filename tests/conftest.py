@@ -0,0 +1,32 @@
+'''Stand in for pyodbc when the odbc driver manager is not installed, so the replay tests run everywhere'''
+import sys
+import types
+
+try:
+    import pyodbc
+except ImportError:
+    # pyodbc raises ImportError when libodbc is missing; the tests only need its exception classes
+    pyodbc = types.ModuleType('pyodbc')
+
+    class Error(Exception):
+        pass
+
+    class DatabaseError(Error):
+        pass
+
+    class OperationalError(DatabaseError):
+        pass
+
+    class ProgrammingError(DatabaseError):
+        pass
+
+    def connect(*args, **kwargs):
+        raise Error('pyodbc is not available, the tests replay result sets through a fake connection')
+
+    for cls in (Error, DatabaseError, OperationalError, ProgrammingError):
+        cls.__module__ = 'pyodbc'
+        setattr(pyodbc, cls.__name__, cls)
+    pyodbc.Connection = pyodbc.Cursor = object
+    pyodbc.connect = connect
+    pyodbc.pooling = True
+    sys.modules['pyodbc'] = pyodbc
@@ -0,0 +1,189 @@
+'''Replay pyodbc message streams of sql server through the profiling mode of pyodbc_sql_function'''
+import json
+import os
+import time
+
+import pyodbc
+import pytest
+
+import pyodbc_sql_function as sql
+from pyodbc_sql_function.profiling import IsProcedureCall, ParsePlanHashes, ParseStatisticsMessages
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'profiling_messages.json')
+
+with open(FIXTURE_PATH, encoding='utf-8') as f:
+    FIXTURE = json.load(f)
+
+
+def ResultSets(name, plan_hash='0x1111111111111111'):
+    '''Return the result sets of a recorded statement, with the plan hash filled in'''
+    result_sets = json.loads(json.dumps(FIXTURE[name]['result_sets']))
+    for result_set in result_sets:
+        result_set['rows'] = [[value.replace('{plan_hash}', plan_hash) if isinstance(value, str) else value for value in row]
+                              for row in result_set['rows']]
+    return result_sets
+
+
+def AllMessages(name):
+    return [tuple(message) for result_set in FIXTURE[name]['result_sets'] for message in result_set['messages']]
+
+
+class FakeCursor:
+    '''Replay result sets through the part of the pyodbc cursor interface used by pyodbc_sql_function'''
+    def __init__(self, connection):
+        self.connection = connection
+        self.result_sets = []
+        self.index = 0
+        self.description = None
+        self.messages = None
+        self.fast_executemany = False
+
+    def execute(self, sql_string, *params):
+        self.connection.executed.append(sql_string)
+        if sql_string.startswith('SET STATISTICS'):
+            return self
+        if self.connection.delay:
+            time.sleep(self.connection.delay)
+            if self.connection.cancelled:
+                raise pyodbc.OperationalError('HY008', '[HY008] Operation canceled (0) (SQLExecDirectW)')
+        self.result_sets = self.connection.result_sets
+        self.index = 0
+        self._Load()
+        return self
+
+    def _Load(self):
+        result_set = self.result_sets[self.index]
+        self.description = result_set['description']
+        self.rows = [tuple(row) for row in result_set['rows']]
+        self.messages = [tuple(message) for message in result_set['messages']]
+
+    def fetchall(self):
+        if self.description is None:
+            raise pyodbc.ProgrammingError('24000', 'No results.  Previous SQL was not a query.')
+        rows, self.rows = self.rows, []
+        return rows
+
+    def nextset(self):
+        if self.index + 1 >= len(self.result_sets):
+            self.description = None
+            self.messages = []
+            return False
+        self.index += 1
+        self._Load()
+        return True
+
+    def cancel(self):
+        self.connection.cancelled = True
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, result_sets, delay=0):
+        self.result_sets = result_sets
+        self.delay = delay
+        self.timeout = 0
+        self.cancelled = False
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def ReadHistory(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_parse_select_statistics():
+    stats = ParseStatisticsMessages(AllMessages('select'))
+    assert stats['logical_reads'] == 120
+    assert stats['physical_reads'] == 3
+    assert stats['read_ahead_reads'] == 40
+    assert stats['tables'] == {'BuildingHMA': {'scan_count': 1, 'logical_reads': 120, 'physical_reads': 3, 'read_ahead_reads': 40}}
+    assert (stats['compile_cpu_ms'], stats['compile_elapsed_ms']) == (2, 3)
+    assert (stats['cpu_ms'], stats['elapsed_ms']) == (15, 20)
+
+
+def test_parse_procedure_counts_the_exec_total_once():
+    messages = AllMessages('procedure')
+    stats = ParseStatisticsMessages(messages, procedure=True)
+    assert (stats['cpu_ms'], stats['elapsed_ms']) == (31, 40)
+    assert stats['time_messages'] == 3
+    assert stats['logical_reads'] == 500
+    assert set(stats['tables']) == {'Form3', 'Form5', 'Worktable'}
+    # a batch of statements has no total message, so every message is summed
+    assert ParseStatisticsMessages(messages)['cpu_ms'] == 62
+
+
+@pytest.mark.parametrize('sql_string, expected', [
+    ('execute dbo.ExportCentaScoreData', True),
+    ('  EXEC dbo.ExportCentaScoreData ?', True),
+    ('{call dbo.ExportCentaScoreData}', True),
+    ('SELECT * FROM dbo.Executions', False),
+    ('update dbo.video set executed = 1', False),
+])
+def test_is_procedure_call(sql_string, expected):
+    assert IsProcedureCall(sql_string) == expected
+
+
+def test_parse_plan_hashes():
+    plan = ResultSets('showplan', '0xABCDEF0123456789')[1]['rows'][0][0]
+    assert ParsePlanHashes([plan]) == ['0xABCDEF0123456789']
+
+
+def test_exec_query_skips_plans_and_flags_plan_change(tmp_path):
+    history_path = str(tmp_path / 'query_profile.jsonl')
+    for plan_hash in ('0x1111111111111111', '0x1111111111111111', '0x2222222222222222'):
+        with sql.Profiling('HmaHierarchy', history_path=history_path, capture_plan=True):
+            with sql.StageLabel('validate'):
+                data, col_name = sql.ExecQuery(FakeConnection(ResultSets('showplan', plan_hash)), FIXTURE['showplan']['sql'])
+        assert data == [('太古城',)]
+        assert col_name == ['HMA']
+
+    records = ReadHistory(history_path)
+    assert [record['plan_changed'] for record in records] == [False, False, True]
+    assert records[-1]['plan_hashes'] == ['0x2222222222222222']
+    assert records[-1]['stage'] == 'validate'
+    assert (records[-1]['logical_reads'], records[-1]['cpu_ms']) == (120, 15)
+
+
+def test_exec_query_procedure_record(tmp_path):
+    history_path = str(tmp_path / 'query_profile.jsonl')
+    connection = FakeConnection(ResultSets('procedure'))
+    with sql.Profiling('RealEstateAgentScore', history_path=history_path):
+        data, col_name = sql.ExecQuery(connection, FIXTURE['procedure']['sql'], True)
+    assert col_name == ['cuntcode', 'KeyAgentNo']
+    assert len(data) == 2
+    assert 'SET STATISTICS IO ON; SET STATISTICS TIME ON; SET STATISTICS XML OFF;' in connection.executed
+
+    record, = ReadHistory(history_path)
+    assert (record['cpu_ms'], record['elapsed_ms']) == (31, 40)
+    assert record['logical_reads'] == 500
+    assert record['status'] == 'success'
+
+
+def test_deadline_only_writes_no_record(tmp_path):
+    history_path = str(tmp_path / 'query_profile.jsonl')
+    connection = FakeConnection(ResultSets('select'))
+    with sql.Profiling('HmaHierarchy', history_path=history_path, capture_stats=False, deadline=600):
+        sql.ExecNonQuerySQL(connection, FIXTURE['select']['sql'])
+    assert not os.path.exists(history_path)
+    assert not any(statement.startswith('SET STATISTICS') for statement in connection.executed)
+    assert connection.timeout == 0
+
+
+def test_deadline_cancels_query(tmp_path):
+    connection = FakeConnection(ResultSets('select'), delay=0.5)
+    with pytest.raises(sql.QueryDeadlineExceeded):
+        with sql.Profiling('HmaHierarchy', history_path=None, capture_stats=False, deadline=0.1):
+            sql.ExecNonQuerySQL(connection, FIXTURE['select']['sql'])
+    assert connection.cancelled
+    assert connection.timeout == 0